@@ -0,0 +1,144 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from common import GameConfig
+from game import Game
+from worlds import sample_worlds
+from simulate import Policy, play_game
+
+# Benchmarks of the core game operations over a sweep of problem sizes. Every case is timed (best of a few runs)
+# and its peak memory is traced in a separate run. The results are written as JSON, so runs of different commits
+# can be compared with --compare.
+
+# seconds a fresh interpreter may take to import the moderator tool (tui.py), checked by the startup case
+STARTUP_TARGET = 0.25
+
+
+def measure(f, setup, repeat: int):
+    """Returns the fastest of repeat runs of f(setup()) in seconds and the peak memory allocated by one run of f in
+    bytes. setup is neither timed nor traced.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        arg = setup()
+        start = time.perf_counter()
+        f(arg)
+        best = min(best, time.perf_counter() - start)
+    arg = setup()
+    tracemalloc.start()
+    f(arg)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def new_config(num_worlds: int, num_players: int, num_wolves: int, num_shards: int = 1) -> GameConfig:
+    return GameConfig(num_worlds, num_players, num_wolves, 1, num_players - num_wolves - 1, num_shards=num_shards)
+
+
+def new_game(config: GameConfig) -> Game:
+    game = Game(config, rng=0)
+    # kill some players in some worlds, so the ranking has to skip dead wolves
+    game.ww_kill(0, 1)
+    return game
+
+
+def save_and_load(game: Game):
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, "state.snap")
+        game.save_game(filename)
+        Game.load_game(game._config, filename)
+
+
+def startup(_):
+    subprocess.run([sys.executable, "-c", "import tui"], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+# every case returns (setup, f), f(setup()) is measured
+CASES = {
+    "sample_worlds": lambda c: (lambda: c, lambda c: sample_worlds(c.num_worlds, c.num_players, c.num_roles,
+                                                                   c.role_dist, rng=0)),
+    "ww_kill": lambda c: (lambda: new_game(c), lambda g: g.ww_kill(2, 3)),
+    "seer_check": lambda c: (lambda: new_game(c), lambda g: g.seer_check(2, 3)),
+    "lynch": lambda c: (lambda: new_game(c), lambda g: g.lynch(2)),
+    "highest_ranking_werewolf": lambda c: (lambda: new_game(c), lambda g: g._get_highest_ranking_werewolf()),
+    "update_role_distributions": lambda c: (lambda: new_game(c), lambda g: g._update_role_distributions()),
+    "save_load": lambda c: (lambda: new_game(c), save_and_load),
+    "full_game": lambda c: (lambda: c, lambda c: play_game(c, Policy(), np.random.SeedSequence(0), max_days=50)),
+    # independent of the configuration, the time includes starting the interpreter
+    "startup": lambda c: (lambda: None, startup),
+}
+# cases that do not depend on the configuration, they run once outside the sweep and are recorded with zero sizes
+FIXED_CASES = {"startup"}
+
+
+def run(cases, sizes, players, wolves, repeat: int, num_shards: int = 1) -> list:
+    records = []
+    print("%-26s %10s %7s %6s %12s %12s" % ("case", "worlds", "players", "wolves", "time [ms]", "peak [MB]"))
+    sweep = itertools.product([case for case in cases if case not in FIXED_CASES], sizes, players, wolves)
+    runs = [(case, 0, 0, 0) for case in cases if case in FIXED_CASES]
+    runs.extend((case, num_worlds, num_players, num_wolves) for case, num_worlds, num_players, num_wolves in sweep
+                if num_wolves + 1 < num_players)
+    for case, num_worlds, num_players, num_wolves in runs:
+        config = None if case in FIXED_CASES else new_config(num_worlds, num_players, num_wolves, num_shards)
+        setup, f = CASES[case](config)
+        seconds, peak = measure(f, setup, repeat)
+        records.append({"case": case, "num_worlds": num_worlds, "num_players": num_players,
+                        "num_wolves": num_wolves, "num_shards": num_shards, "seconds": seconds, "peak_bytes": peak})
+        print("%-26s %10d %7d %6d %12.2f %12.2f" % (case, num_worlds, num_players, num_wolves, 1e3 * seconds,
+                                                    peak / 2 ** 20))
+        if case == "startup" and seconds > STARTUP_TARGET:
+            print("Startup is slower than the target of %.0f ms" % (1e3 * STARTUP_TARGET))
+    return records
+
+
+def metadata() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ""
+    return {"commit": commit, "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "numpy": np.__version__, "machine": platform.machine()}
+
+
+def compare(old: dict, new: dict):
+    """Prints the time and memory ratio new / old of every case that is in both results."""
+    key = lambda r: (r["case"], r["num_worlds"], r["num_players"], r["num_wolves"])
+    old_records = {key(r): r for r in old["results"]}
+    print("%-26s %10s %7s %6s %12s %12s" % ("case", "worlds", "players", "wolves", "time ratio", "peak ratio"))
+    for record in new["results"]:
+        if key(record) not in old_records:
+            continue
+        previous = old_records[key(record)]
+        print("%-26s %10d %7d %6d %12.2f %12.2f" % (key(record) + (record["seconds"] / previous["seconds"],
+                                                                   record["peak_bytes"] / max(previous["peak_bytes"], 1))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks the core game operations.")
+    parser.add_argument("--cases", nargs="+", default=list(CASES), choices=list(CASES))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6],
+                        help="numbers of worlds, up to 10^7 for a full sweep")
+    parser.add_argument("--players", type=int, nargs="+", default=[8, 16])
+    parser.add_argument("--wolves", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--shards", type=int, default=1, help="worker processes the worlds of a game are split over")
+    parser.add_argument("--output", default="bench.json", help="file the results are written to")
+    parser.add_argument("--compare", help="results of an earlier run to compare against")
+    args = parser.parse_args()
+    results = {"meta": metadata(),
+               "results": run(args.cases, args.sizes, args.players, args.wolves, args.repeat, args.shards)}
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(json.load(f), results)
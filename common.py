@@ -16,8 +16,31 @@ class GameConfig:
     """
     N: Number worlds
     P: Number of players
+    world_mode: How the worlds are created.
+        "sample": N independently sampled worlds (default)
+        "dedup": N sampled worlds, identical worlds are merged into one weighted world
+        "exact": every distinct role assignment exactly once, N is ignored
+    seed: Seed of the random stream of the game, which samples the worlds and draws the outcomes of the actions. The
+        same seed always gives the same worlds and outcomes.
+    num_shards: Number of worker processes the worlds are split over (see shards.py), 1 keeps them in the process of
+        the game. The game plays the same with any number of shards, replenished worlds are sampled in the process of
+        the game and only then split over the shards.
+    min_worlds: Once fewer worlds are left after an action, new worlds that agree with everything that happened so far
+        are sampled until there are N worlds again (see Game._replenish). None never adds worlds. Only possible in the
+        "sample" mode, the "exact" mode already holds every possible world and the new worlds would not be merged with
+        the weighted worlds of the "dedup" mode.
+    memory_budget: Bytes the worlds of the game may take. Fewer worlds are sampled if N does not fit, and the actions
+        process the worlds in chunks whose temporaries fit the rest of the budget (see Game._apply_memory_budget).
+        None processes all worlds at once.
     """
-    def __init__(self, num_worlds, num_players, num_wolves, num_seers, num_villagers):
+    WORLD_MODES = ("sample", "dedup", "exact")
+
+    def __init__(self, num_worlds, num_players, num_wolves, num_seers, num_villagers, world_mode="sample",
+                 seed=None, num_shards=1, min_worlds=None, memory_budget=None):
+        if world_mode not in self.WORLD_MODES:
+            raise ValueError("Unknown world mode: %s" % world_mode)
+        if min_worlds is not None and world_mode != "sample":
+            raise ValueError("Worlds can only be replenished in the sample mode")
         self.num_worlds = num_worlds
         self.num_players = num_players
         self.num_wolves = num_wolves
@@ -26,6 +49,11 @@ class GameConfig:
         self.num_roles = num_wolves + 2
         self.role_dist = [num_villagers, num_seers]
         self.role_dist.extend([1] * self.num_wolves)
+        self.world_mode = world_mode
+        self.seed = seed
+        self.num_shards = num_shards
+        self.min_worlds = min_worlds
+        self.memory_budget = memory_budget
 
 # quick index to get access to all wolves
 class Roles:
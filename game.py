@@ -1,155 +1,565 @@
-from worlds import sample_worlds
+from worlds import sample_worlds, enumerate_worlds, WorldStore
+from shards import LocalShards, ShardPool, WorldShard, NO_WOLVES, WOLF_MAJORITY, sample_consistent_worlds
+import functools
+import time
+import warnings
 import numpy as np
 from common import GameConfig, Roles
+import snapshot
+from instrumentation import ActionRecord, role_entropy
 
 
-# one coin flip, returns True with probability p
-def flip(p):
-    return np.random.uniform() <= p
+# one coin flip with the generator rng, returns True with probability p
+def flip(p, rng: np.random.Generator):
+    return bool(rng.uniform() <= p)
 
 
-# function decorator for game actions, ensures cleanup
+# names of the actions that can be resolved together at night, see Game.resolve_night
+WW_KILL = "ww_kill"
+SEER_CHECK = "seer_check"
+# result of a night action that was skipped because it was impossible
+SKIPPED = "skipped"
+# factions that can win the game, see Game.winner
+VILLAGERS = "villagers"
+WOLVES = "wolves"
+# fewest worlds that are processed at once under a memory budget, however small the budget
+MIN_CHUNK_SIZE = 4096
+
+
+def _budget_bytes_per_world(config: GameConfig, weighted: bool) -> int:
+    """Bytes a world takes in the memory budget, twice its bytes if the game replenishes, as a batch of new worlds
+    may be as large as the worlds of the game.
+    """
+    per_world = WorldShard.bytes_per_world(config.num_players, weighted)
+    return 2 * per_world if config.min_worlds is not None else per_world
+
+
+def feasible_num_worlds(config: GameConfig) -> int:
+    """Largest number of worlds that fits the memory budget of the configuration, leaving room for the temporaries of
+    a chunk of MIN_CHUNK_SIZE worlds in every shard and for a batch of replenished worlds (see Game._replenish).
+    """
+    per_world = _budget_bytes_per_world(config, config.world_mode != "sample")
+    chunks = config.num_shards * MIN_CHUNK_SIZE * WorldShard.chunk_bytes_per_world(config.num_players)
+    return max((config.memory_budget - chunks) // per_world, 0)
+
+
+class InvalidAction(ValueError):
+    """Raised before an action changes anything if the action is impossible in every remaining world."""
+    pass
+
+
+class Preview:
+    """One possible outcome of an action, as computed by the preview methods of the game without running it."""
+
+    def __init__(self, outcome, probability: float, num_worlds: int, role_dist: np.ndarray):
+        self.outcome = outcome  # what the action would return
+        self.probability = probability
+        self.num_worlds = num_worlds  # worlds that would survive
+        self.role_dist = role_dist  # role distribution after the action, see Game._role_dist
+
+    def __repr__(self):
+        return "%s (p=%.3f): %d worlds" % (self.outcome, self.probability, self.num_worlds)
+
+
+# function decorator for game actions, ensures cleanup, records the changes for undo, bumps the version of the worlds
+# and reports the action to the observers of the game
 def action(f):
-    def wrapper(*args):
-        ret = f(*args)
-        args[0]._update_role_distributions()
+    @functools.wraps(f)
+    def wrapper(*args, **kwargs):
+        game = args[0]
+        worlds_before = len(game._shards)
+        start = time.perf_counter()
+        game._steps = []
+        try:
+            ret = f(*args, **kwargs)
+        finally:
+            # also keeps the game consistent if a batch of actions stops early
+            game._finish_action(f.__name__)
+        game._notify(f.__name__, args[1:], kwargs, ret, start, worlds_before)
         return ret
 
     return wrapper
 
 
 class Game:
-    def __init__(self, config: GameConfig, world=None):
+    def __init__(self, config: GameConfig, world=None, rng=None):
+        """
+        :param config: Configuration of the game
+        :param world: WorldStore to continue with, new worlds are created from the configuration if None
+        :param rng: np.random.Generator, SeedSequence or seed of the random stream of the game, the seed of the
+            configuration if None
+        """
         self._config = config
+        # the worlds are sampled and the outcomes of the actions are drawn from this generator only, so games with the
+        # same seed play the same in any thread or process. Its state is stored in the saves of the game.
+        self._rng = np.random.default_rng(np.random.SeedSequence(config.seed) if rng is None else rng)
 
         if world is None:
-            self._world = sample_worlds(self._config.num_worlds, self._config.num_players, self._config.num_roles,
-                                        self._config.role_dist)
+            world = self._create_worlds(self._rng)
+        if config.memory_budget is not None:
+            self._apply_memory_budget(world)
+        # number of worlds the buffers have room for, _replenish fills them up to it. Saved with the worlds, so a
+        # loaded game keeps it.
+        self._capacity = world.capacity
+        self._chunk_size = world.chunk_size
+        # the worlds are split over worker processes if the configuration asks for more than one shard
+        if config.num_shards > 1:
+            self._shards = ShardPool(world, config.num_roles, config.num_wolves, config.num_shards)
         else:
-            self._world = world
+            self._shards = LocalShards(world, config.num_roles, config.num_wolves)
 
         self._roles = Roles(self._config.num_wolves)
+        # weighted number of worlds in which each player has each role (last column: is dead), summed over the shards
+        # by _update_role_distributions
+        self._role_counts = None
+        self._total_weight = None
+        self._faction_counts = None  # weighted number of worlds with each status, see WorldShard.status
         self._role_dist = None
         self._update_role_distributions()
+        # callables that get an instrumentation.ActionRecord after every action
+        self._observers = []
+        # (name, steps) of the past actions that changed the worlds, the last one is undone first (see undo). Undone
+        # actions move to _redo until the next action. What an action changed is kept by the shards.
+        self._history = []
+        self._redo = []
+        self._history_start = 0  # number of actions before the first one in the history, which can not be undone
+        # steps of the running action, every step is a method of WorldShard with its arguments (see _step).
+        # All steps of the game are the constraints that new worlds must agree with (see _replenish).
+        self._steps = []
+        self._constraints = []  # steps that are no longer in the history
+        self._num_replenished = 0
+        # bumped by every action, undo and redo. Queries over all worlds are cached until it changes, see _cached.
+        self._version = 0
+        self._cache = {}
 
-    def save_game(self, filename):
-        np.save(filename, self._world)
+    def _create_worlds(self, rng) -> WorldStore:
+        config = self._config
+        if config.world_mode == "exact":
+            return enumerate_worlds(config.num_players, config.num_roles, config.role_dist)
+        num_worlds = config.num_worlds
+        if config.memory_budget is not None:
+            num_worlds = min(num_worlds, feasible_num_worlds(config))
+            if num_worlds == 0:
+                raise ValueError("The memory budget of %d bytes does not fit any worlds" % config.memory_budget)
+            if num_worlds < config.num_worlds:
+                warnings.warn("Only %d of the %d worlds fit the memory budget of %d bytes, the game is played with %d "
+                              "worlds" % (num_worlds, config.num_worlds, config.memory_budget, num_worlds))
+        world = sample_worlds(num_worlds, config.num_players, config.num_roles, config.role_dist, rng)
+        if config.world_mode == "dedup":
+            world.deduplicate()
+        return world
+
+    def _apply_memory_budget(self, world: WorldStore):
+        """Sets the chunk size of the worlds (see WorldStore.chunk_size), so that the temporaries of the actions in all
+        shards fit the part of the memory budget the worlds leave. Warns if the worlds alone nearly exceed it, e.g.
+        in the "exact" mode or for a loaded game.
+        """
+        config = self._config
+        per_world = _budget_bytes_per_world(config, world.weights is not None)
+        chunk_bytes = config.num_shards * WorldShard.chunk_bytes_per_world(config.num_players)
+        left = config.memory_budget - world.capacity * per_world
+        if left < MIN_CHUNK_SIZE * chunk_bytes:
+            warnings.warn("The %d worlds need about %d bytes, more than the memory budget of %d bytes allows"
+                          % (world.capacity, world.capacity * per_world + MIN_CHUNK_SIZE * chunk_bytes,
+                             config.memory_budget))
+        world.chunk_size = max(left // chunk_bytes, MIN_CHUNK_SIZE)
+
+    def save_game(self, filename, metadata: dict = None):
+        """Writes the worlds as a snapshot (see snapshot.py), metadata is stored in its header together with the
+        constraints for replenishing the worlds.
+        """
+        metadata = dict(metadata or {}, constraints=self.constraints(), replenished=self._num_replenished,
+                        rng=self._rng_state())
+        snapshot.save_worlds(filename, self._shards.stores(), self._config.num_roles, metadata,
+                             capacity=self._capacity)
+
+    def close(self):
+        """Stops the worker processes of a sharded game, the game can not be used afterwards."""
+        self._shards.close()
 
     @staticmethod
     def load_game(config: GameConfig, filename):
-        world = np.load(filename)
-        return Game(config, world)
+        if not snapshot.is_snapshot(filename):
+            # saves of older versions, .npz files of the world arrays or .npy files of the one-hot world tensor
+            saved = np.load(filename)
+            if isinstance(saved, np.ndarray):
+                return Game(config, WorldStore.from_one_hot(saved))
+            weights = saved["weights"] if "weights" in saved else None
+            return Game(config, WorldStore(saved["roles"], saved["dead"], weights))
+        metadata = snapshot.read_header(filename)["metadata"]
+        game = Game(config, snapshot.load_worlds(filename))
+        game._constraints = [(name, tuple(args)) for name, args in metadata.get("constraints", [])]
+        game._num_replenished = metadata.get("replenished", 0)
+        if "rng" in metadata:
+            game._set_rng_state(metadata["rng"])
+        return game
+
+    def spawn_rng(self) -> np.random.Generator:
+        """Returns a new generator that is independent of the one of the game but derived from the same seed, e.g. for
+        the decisions of simulated players.
+        """
+        return np.random.default_rng(self._spawn_seed())
+
+    def _spawn_seed(self) -> np.random.SeedSequence:
+        return self._rng.bit_generator.seed_seq.spawn(1)[0]
+
+    def _rng_state(self) -> dict:
+        """State of the generator of the game, together with its seed so that it can spawn the same streams."""
+        seed_seq = self._rng.bit_generator.seed_seq
+        return {"entropy": seed_seq.entropy, "spawn_key": list(seed_seq.spawn_key),
+                "children": seed_seq.n_children_spawned, "state": self._rng.bit_generator.state}
+
+    def _set_rng_state(self, state: dict):
+        seed_seq = np.random.SeedSequence(state["entropy"], spawn_key=state["spawn_key"],
+                                          n_children_spawned=state["children"])
+        bit_generator = getattr(np.random, state["state"]["bit_generator"])(seed_seq)
+        bit_generator.state = state["state"]
+        self._rng = np.random.Generator(bit_generator)
+
+    def add_observer(self, observer):
+        """Registers a callable that is called with an instrumentation.ActionRecord after every action."""
+        self._observers.append(observer)
+
+    def remove_observer(self, observer):
+        self._observers.remove(observer)
+
+    def can_undo(self) -> bool:
+        return bool(self._history)
+
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def history_position(self) -> int:
+        """Number of actions that are in effect, undone ones are not counted. Undo returns to the position before the
+        last action.
+        """
+        return self._history_start + len(self._history)
+
+    def num_undoable_actions(self) -> int:
+        """Number of actions undo can revert, the ones before a load or a replenishment are not kept."""
+        return len(self._history)
+
+    def undo(self) -> str:
+        """Reverts the last action, in time and memory proportional to the worlds and dead flags it changed.
+        :return: Name of the reverted action
+        """
+        if not self._history:
+            raise IndexError("Nothing to undo")
+        start, worlds_before = time.perf_counter(), len(self._shards)
+        name, steps = self._history.pop()
+        self._shards.call("undo")
+        self._version += 1
+        self._update_role_distributions()
+        self._redo.append((name, steps))
+        self._notify("undo", (), {}, name, start, worlds_before)
+        return name
+
+    def redo(self) -> str:
+        """Repeats the last undone action with the same outcome.
+        :return: Name of the repeated action
+        """
+        if not self._redo:
+            raise IndexError("Nothing to redo")
+        start, worlds_before = time.perf_counter(), len(self._shards)
+        name, steps = self._redo.pop()
+        self._shards.call("redo")
+        self._version += 1
+        self._update_role_distributions()
+        self._history.append((name, steps))
+        self._notify("redo", (), {}, name, start, worlds_before)
+        return name
+
+    def constraints(self) -> list:
+        """All steps of the game so far, (name of a method of WorldShard, arguments). Every world of the game is a
+        sampled world that survived these steps.
+        """
+        return self._constraints + [step for _, steps in self._history for step in steps]
 
     def game_finished(self) -> bool:
         """Returns true if the game is finished (either only wolves or only villagers alive."""
-        pass
+        return self.winner() is not None
+
+    def winner(self):
+        """Returns the faction (VILLAGERS or WOLVES) that has won in every remaining world, None otherwise.
+        Villagers win once all wolves are dead, wolves win once at least as many wolves as villagers are alive.
+        """
+        # the number of worlds with each status (see WorldShard.status) is kept up to date by the actions
+        counts = self._faction_counts
+        if counts[NO_WOLVES] + counts[NO_WOLVES | WOLF_MAJORITY] == self._total_weight:
+            return VILLAGERS
+        if counts[WOLF_MAJORITY] + counts[NO_WOLVES | WOLF_MAJORITY] == self._total_weight:
+            return WOLVES
+        return None
+
+    def faction_probabilities(self) -> dict:
+        """Returns the fraction of the worlds in which each faction (VILLAGERS, WOLVES) has already won, the rest of
+        the worlds is undecided.
+        """
+        counts = self._faction_counts / self._total_weight
+        return {VILLAGERS: float(counts[NO_WOLVES] + counts[NO_WOLVES | WOLF_MAJORITY]),
+                WOLVES: float(counts[WOLF_MAJORITY])}
 
     def is_dead(self, i):
         # returns true if character is dead
-        players = self._world[:, :, self._roles.DEAD.value] == 1
-        return players[:, i].all()
+        return self._role_counts[i, -1] == self._total_weight
+
+    def is_known_wolf(self, i):
+        # returns true if character is a wolf in every world
+        return self._role_counts[i, self._roles.WOLVES.value].sum() == self._total_weight
 
     # prints all dead characters
     def print_dead(self):
-        players = self._world[:, :, self._roles.DEAD.value] == 1
         for i in range(self._config.num_players):
             print("Player %d is %s" % (i, "DEAD" if self.is_dead(i) else "ALIVE"))
 
+    def num_worlds(self) -> int:
+        """Number of remaining worlds."""
+        return len(self._shards)
+
     def worlds_collapse(self) -> bool:
         """Returns true if all worlds collapse, i.d. there is only a single world remaining.
         """
-        return self._world.shape[0] == 1
+        return len(self._shards) == 1
+
+    # All actions take an optional outcome, the result of an earlier call of the same action in the same state.
+    # It replaces the random draws, so a game can be replayed from its log exactly. The draws are still made, so the
+    # generator of a replayed game ends up in the same state as the one of the original game.
 
     # represents the action that a werewolf starts a kill
     @action
-    def ww_kill(self, p1: int, p2: int):
-        # we must drop the universes where both players are werewolves
-        mask_p1_ww = self._player_is_wolf(p1)
-        mask_p2_ww = self._player_is_wolf(p2)
-        mask_elim = np.logical_and(mask_p1_ww, mask_p2_ww)
-        self._world = self._world[np.logical_not(mask_elim)]
-
-        # mask that indicates in which worlds p1 is the currently highest ranking werewolf
-        mask = self._get_highest_ranking_werewolf() == p1
-        # i think this is the fastest, sadly, we will see this more often
-        # sets player 2 dead in every world where p1 is the currently highest ranking werewolf
-        for i in range(mask.size):
-            if mask[i]:
-                self._world[i, p2, self._roles.DEAD.value] = 1
-
-        # necessary to check if player is dead
-        self._update_role_distributions()
-        # check if target player is totally dead and collapse his role in case
-        if self.is_dead(p2):
-            # reveals role of player
-            role = np.random.choice(self._config.num_roles,
-                                    p=self._role_dist[p2, :-1])  # samples using the role dist array
-            # print("Player %i was Role %i" % (player, role))
-            # eliminates all universes where the player did not have that role
-            mask_role = self._world[:, p2, role] != 1
-            self._world = self._world[mask_role]
+    def ww_kill(self, p1: int, p2: int, outcome=None):
+        """
+        Player 1 attacks player 2.
+        :return: The revealed role of player 2 if player 2 is now dead in every world, None otherwise.
+        """
+        self._check_players(p1, p2)
+        return self._ww_kill(p1, p2, outcome)
 
     @action
-    def seer_check(self, p1: int, p2: int) -> bool:
+    def seer_check(self, p1: int, p2: int, outcome=None) -> bool:
         """
         Player 1 checks player 2.
         :return: True if player 2 is seen as evil, false otherwise.
         """
+        self._check_players(p1, p2)
+        return self._seer_check(p1, p2, outcome)
+
+    @action
+    def lynch(self, player: int, outcome=None) -> int:
+        """
+        :return: The revealed role of the lynched player.
+        """
+        self._check_players(player)
+        return self._lynch(player, outcome)
+
+    @action
+    def resolve_night(self, night_actions, outcome=None) -> list:
+        """
+        Resolves all actions of a night in the given order, with the same outcomes as calling them one after another.
+        The eliminations of all actions are combined and the worlds are compacted only once at the end.
+        Actions that would raise InvalidAction on their own are skipped.
+        :param night_actions: List of (WW_KILL or SEER_CHECK, source player, target player)
+        :return: List with the result of every action (see ww_kill and seer_check), SKIPPED for skipped actions
+        """
+        self._check_players(*[player for _, source, target in night_actions for player in (source, target)])
+        resolvers = {WW_KILL: self._ww_kill, SEER_CHECK: self._seer_check}
+        outcome = outcome or [None] * len(night_actions)
+        results = []
+        for (kind, source, target), action_outcome in zip(night_actions, outcome):
+            if action_outcome == SKIPPED:
+                results.append(SKIPPED)
+                continue
+            # outcomes are drawn from the distribution after the previous actions, as if they ran on their own
+            self._update_role_distributions()
+            try:
+                results.append(resolvers[kind](source, target, action_outcome))
+            except InvalidAction:
+                results.append(SKIPPED)
+        return results
+
+    # The previews compute every outcome of an action with its probability from masks and counts over the worlds,
+    # the game itself is not changed.
+
+    def preview_ww_kill(self, p1: int, p2: int) -> list:
+        """Outcomes of ww_kill(p1, p2), a single one with the outcome None if the role of player 2 is not revealed.
+        :return: List of Preview
+        """
+        self._check_players(p1, p2)
+        if self.is_known_wolf(p1) and self.is_known_wolf(p2):
+            raise InvalidAction("Player %d and player %d are wolves in every world" % (p1, p2))
+        results = self._shards.call("preview_attack", p1, p2)
+        counts, total, num_worlds = self._sum_counts([after for after, _ in results])
+        if counts[p2, -1] != total:
+            return [Preview(None, 1.0, num_worlds, counts / total)]
+        return self._preview_reveal([reveals for _, reveals in results], counts[p2, :-1] / total)
+
+    def preview_seer_check(self, p1: int, p2: int) -> list:
+        """Outcomes of seer_check(p1, p2), True if player 2 is seen as evil.
+        :return: List of Preview
+        """
+        self._check_players(p1, p2)
+        p_evil = float(self._role_dist[p2, self._roles.WOLVES.value].sum())
+        results = self._shards.call("preview_seer_result", p1, p2)
+        previews = []
+        for evil, probability in [(True, p_evil), (False, 1 - p_evil)]:
+            counts, total, num_worlds = self._sum_counts([result[evil] for result in results])
+            if total > 0:
+                previews.append(Preview(evil, probability, num_worlds, counts / total))
+        return previews
+
+    def preview_lynch(self, player: int) -> list:
+        """Outcomes of lynch(player), one for every role the player can reveal.
+        :return: List of Preview
+        """
+        self._check_players(player)
+        if self.is_dead(player):
+            raise InvalidAction("Player %d is dead in every world" % player)
+        results = self._shards.call("preview_lynch", player)
+        counts, total, _ = self._sum_counts([alive for alive, _ in results])
+        return self._preview_reveal([reveals for _, reveals in results], counts[player, :-1] / total)
+
+    def _preview_reveal(self, reveals: list, role_probabilities: np.ndarray) -> list:
+        """Previews of the roles a player can reveal, reveals holds the counts per role of every shard."""
+        previews = []
+        for role in np.flatnonzero(role_probabilities):
+            counts, total, num_worlds = self._sum_counts([shard[role] for shard in reveals if role in shard])
+            previews.append(Preview(int(role), float(role_probabilities[role]), num_worlds, counts / total))
+        return previews
+
+    def _sum_counts(self, counts: list) -> tuple:
+        """Adds up the (role counts, total weight, number of worlds) of the shards."""
+        summed = np.zeros((self._config.num_players, self._config.num_roles + 1), dtype=np.int64)
+        for shard_counts, _, _ in counts:
+            summed += shard_counts
+        return summed, sum(total for _, total, _ in counts), sum(num_worlds for _, _, num_worlds in counts)
+
+    def _check_players(self, *players):
+        """Raises ValueError for players that are not in the game, the dead bits of a negative index would belong to
+        no player.
+        """
+        for player in players:
+            if not 0 <= player < self._config.num_players:
+                raise ValueError("There is no player %s" % player)
+
+    def _ww_kill(self, p1: int, p2: int, role=None):
+        if self.is_known_wolf(p1) and self.is_known_wolf(p2):
+            raise InvalidAction("Player %d and player %d are wolves in every world" % (p1, p2))
+        # drops the universes where both players are werewolves, sets player 2 dead in every world where p1 is the
+        # currently highest ranking werewolf
+        self._step("attack", p1, p2)
+
+        # cheap normalisation of the counts, needed for sampling the role
+        self._update_role_distributions()
+        # check if target player is totally dead and collapse his role in case
+        if not self.is_dead(p2):
+            return None
+        # reveals role of player, samples using the role dist array
+        drawn = int(self._rng.choice(self._config.num_roles, p=self._role_dist[p2, :-1]))
+        role = drawn if role is None else role
+        # print("Player %i was Role %i" % (player, role))
+        # only worlds where player 2 died can have led to this outcome. All worlds of the game are such worlds, but new
+        # worlds (see _replenish) must be checked.
+        self._steps.append(("drop_alive", (p2,)))
+        # eliminates all universes where the player did not have that role
+        self._step("reveal", p2, role)
+        return role
+
+    def _seer_check(self, p1: int, p2: int, evil=None) -> bool:
         # check which role p2 could be having
-        evil = flip(self._role_dist[p2, self._roles.WOLVES.value].sum())  # True if p1 sees p2 as evil
+        drawn = flip(self._role_dist[p2, self._roles.WOLVES.value].sum(), self._rng)  # True if p1 sees p2 as evil
+        evil = drawn if evil is None else evil
         # eliminiation
-        mask_p1_seer = self._world[:, p1,
-                       self._roles.SEER.value] == 1  # elim all universes where p1 is seer and p2 is not werewolf
-        if evil:  # elim all universes where p2 is not evil
-            mask_p2_villager = self._world[:, p2, self._roles.VILLAGER.value]
-            mask_p2_seer = self._world[:, p2, self._roles.SEER.value]
-            mask_p2 = np.logical_or(mask_p2_seer, mask_p2_villager)
-        else:  # elim all universes where p2 is evil
-            mask_p2 = self._player_is_wolf(p2)
-        mask_elim = np.logical_and(mask_p1_seer, mask_p2)
-        self._world = self._world[np.logical_not(mask_elim)]
+        # elim all universes where p1 is seer and p2 is not werewolf (evil) or werewolf (not evil)
+        self._step("seer_result", p1, p2, evil)
         return evil
 
-    @action
-    def lynch(self, player: int):
-        # kills player
-        role = np.random.choice(self._config.num_roles, p=self._role_dist[player, :-1])  # samples using the role dist array
+    def _lynch(self, player: int, role=None) -> int:
+        if self.is_dead(player):
+            raise InvalidAction("Player %d is dead in every world" % player)
+        # remove all universes where the character was already dead, the role is revealed from the ones where the
+        # character is still alive (otherwise the revealed role could eliminate every world)
+        self._step("drop_dead", player)
+        self._update_role_distributions()
+        # kills player, samples using the role dist array
+        drawn = int(self._rng.choice(self._config.num_roles, p=self._role_dist[player, :-1]))
+        role = drawn if role is None else role
         # print("Player %i was Role %i" % (player, role))
         # eliminates all universes where the player did not have that role
-        mask_role = self._world[:, player, role] != 1
-        # remove all universes where the character was already dead
-        mask_dead = self._world[:, player, self._roles.DEAD.value] == 1
-        mask_elim = np.logical_or(mask_role, mask_dead)
-        self._world = self._world[np.logical_not(mask_elim)]
-        self._world[:, player, self._roles.DEAD.value] = 1  # sets player to dead in all universes that remain
+        self._step("reveal", player, role)
+        self._step("kill", player)  # sets player to dead in all universes that remain
+        return role
 
     def _get_highest_ranking_werewolf(self) -> np.ndarray:
-        """Returns array with the highest ranking werewolf per world.
-        This is an unholy spaghetti function.
-        """
-        wolve_roles = self._world[:, :, self._roles.WOLVES.value] == 1
-        wolves_alive = (self._world[:, :, self._roles.DEAD.value] == 0)[:, :, None]  # evil numpy magic
-        # manually helping numpy broadcasting here
-        alive_wolves = np.logical_and(wolve_roles, wolves_alive)
-        # only the columns left where the wolf is still alive
-        cols_where_wolf_type_still_alive = alive_wolves.any(axis=1)[:, None, :].astype(float)
-        # deliberately sets the values to nan if no wolf there
-        cols_where_wolf_type_still_alive[cols_where_wolf_type_still_alive == 0] = np.nan
-        alive_wolves = alive_wolves * cols_where_wolf_type_still_alive
-        temp = np.hstack([alive_wolves, np.zeros(alive_wolves.shape)])
-        highest_ranking_wolf: np.ndarray = np.nanargmax(temp, axis=1).astype(float)  # contains highest ranking wolf now
-        highest_ranking_wolf[highest_ranking_wolf == self._config.num_players] = np.nan
-        highest_ranking_wolf += np.arange(0, self._config.num_players * self._config.num_wolves, self._config.num_players)  # we abuse that NaN + a = NaN.
-        highest_ranking_wolf = np.nanmin(highest_ranking_wolf, axis=1)  # ignores nan
-        assert highest_ranking_wolf.size == self._world.shape[0], "Internal logical error"
-        return np.mod(highest_ranking_wolf, self._config.num_players)
-
-    # returns a mask of worlds where the player is a wolf
-    def _player_is_wolf(self, p1: int) -> np.ndarray:
-        return (self._world[:, p1, self._roles.WOLVES.value] == 1).any(axis=1)
+        """Returns array with the highest ranking werewolf (the player that does the killing) per world, -1 if all
+        wolves are dead in that world. The array is cached and read-only.
+        """
+        return self._cached("acting_wolf", lambda: np.concatenate(self._shards.call("highest_ranking_werewolf")))
+
+    def _cached(self, key: str, compute) -> np.ndarray:
+        """Returns the query result with the given key, computed once per version of the worlds."""
+        version, result = self._cache.get(key, (None, None))
+        if version != self._version:
+            result = compute()
+            result.flags.writeable = False
+            self._cache[key] = (self._version, result)
+        return result
+
+    def _step(self, name: str, *args):
+        """Runs a step of an action on all shards and records it."""
+        self._shards.call(name, *args)
+        self._steps.append((name, tuple(int(arg) for arg in args)))
+
+    def _finish_action(self, name: str):
+        """Drops the eliminated worlds and adds the action to the history if it changed anything."""
+        changed = any(self._shards.call("finish"))
+        self._shards.call("commit", changed)
+        self._version += 1
+        if changed:
+            self._history.append((name, self._steps))
+            self._redo.clear()
+        elif self._history:
+            # the steps still constrain new worlds, they are undone together with the action before
+            self._history[-1][1].extend(self._steps)
+        else:
+            self._constraints.extend(self._steps)
+        self._steps = []
+        self._update_role_distributions()
+        if self._config.min_worlds is not None and len(self._shards) < self._config.min_worlds:
+            self._replenish()
+
+    def _replenish(self):
+        """Samples new worlds until there are as many as at the start of the game again. New worlds have the revealed
+        roles and must survive every step of the game so far. The actions so far can not be undone afterwards.
+        """
+        constraints = self.constraints()
+        fixed = {args[0]: args[1] for name, args in constraints if name == "reveal"}
+        config = self._config
+        # sampled in the process of the game from a stream spawned from the seed of the game, so a replayed game adds
+        # the same worlds, with any number of shards
+        roles, dead = sample_consistent_worlds(self._capacity - len(self._shards), constraints, fixed, config.role_dist,
+                                               config.num_roles, config.num_wolves,
+                                               np.random.default_rng(self._spawn_seed()), self._chunk_size)
+        # the shards are filled in order, every shard is called to clear its history
+        bounds = np.minimum(np.cumsum([0] + self._shards.free_space()), len(roles))
+        self._shards.call_each("add_worlds", [(roles[start:stop], dead[start:stop])
+                                              for start, stop in zip(bounds[:-1], bounds[1:])])
+        self._num_replenished += 1
+        self._constraints = constraints
+        self._history_start += len(self._history)
+        self._history.clear()
+        self._redo.clear()
+        self._update_role_distributions()
+
+    def _notify(self, name: str, args: tuple, kwargs: dict, result, start: float, worlds_before: int):
+        if self._observers:
+            record = ActionRecord(name, args, kwargs, result, time.perf_counter() - start, worlds_before,
+                                  len(self._shards), self._shards.nbytes, role_entropy(self._role_dist))
+            for observer in self._observers:
+                observer(record)
 
     def _update_role_distributions(self):
-        self._role_dist = self._world.mean(axis=0)
+        self._role_counts, self._total_weight, self._faction_counts = self._shards.counts()
+        self._role_dist = self._role_counts / self._total_weight
 
 
 #game = Game()
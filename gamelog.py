@@ -0,0 +1,117 @@
+import json
+import os
+import shutil
+from common import GameConfig, ensure_dir
+from game import Game
+from instrumentation import ActionRecord
+import snapshot
+
+# Persisted history of a game. Together with the configuration (which holds the seed the worlds are sampled with)
+# a game is stored as an append-only log of all actions and their outcomes, with a line that marks the start of every
+# phase. Only every few phases a snapshot of the worlds is written. Any phase is restored by loading the nearest
+# snapshot before it (or sampling the worlds from the seed again) and replaying the logged actions from there.
+
+LOG_FILE = "log.jsonl"
+SNAPSHOT_DIR = "snapshots"
+# logged like actions, but replayed without arguments, see Game.undo and Game.redo
+HISTORY_ACTIONS = ("undo", "redo")
+
+
+class GameLog:
+    def __init__(self, game_dir: str, snapshot_every: int = 4):
+        self._log_file = os.path.join(game_dir, LOG_FILE)
+        self._snapshot_dir = os.path.join(game_dir, SNAPSHOT_DIR)
+        self._snapshot_every = snapshot_every
+        self._num_phases = len(self.phases())
+
+    @staticmethod
+    def exists(game_dir: str) -> bool:
+        return os.path.exists(os.path.join(game_dir, LOG_FILE))
+
+    def __call__(self, record: ActionRecord):
+        """Observer of the game (see Game.add_observer), logs every action with its outcome."""
+        self._append({"action": record.action, "args": record.args, "kwargs": record.kwargs,
+                      "result": record.result})
+
+    def mark_phase(self, game: Game, label: str, metadata: dict = None):
+        """Marks the start of a phase, the state of the game at this point can be restored with restore(label).
+        metadata is stored in the header of the snapshot, if one is written.
+        """
+        self._append({"phase": label})
+        config = game._config
+        # the first phase can always be rebuilt from the seed, unless the worlds were not sampled from it
+        reproducible = config.seed is not None or config.world_mode == "exact"
+        if self._num_phases % self._snapshot_every == 0 and (self._num_phases > 0 or not reproducible):
+            ensure_dir(self._snapshot_dir)
+            game.save_game(self._snapshot_file(label), dict(metadata or {}, phase=label))
+        self._num_phases += 1
+
+    def phases(self) -> list:
+        """Labels of all phases in the order they were played."""
+        return [entry["phase"] for entry in self._entries() if "phase" in entry]
+
+    def snapshot_header(self, label: str):
+        """Header of the snapshot of the phase with the given label (see snapshot.read_header), None if the phase
+        has no snapshot.
+        """
+        filename = self._snapshot_file(label)
+        return snapshot.read_header(filename) if os.path.exists(filename) else None
+
+    def restore(self, config: GameConfig, label: str) -> Game:
+        """Rebuilds the game as it was at the start of the phase with the given label."""
+        entries = self._entries()
+        target = self._marker_index(entries, label)
+        start = 0
+        game = None
+        for i in range(target, -1, -1):
+            if "phase" in entries[i] and os.path.exists(self._snapshot_file(entries[i]["phase"])):
+                game = Game.load_game(config, self._snapshot_file(entries[i]["phase"]))
+                start = i + 1
+                break
+        if game is None:
+            game = Game(config)
+        for entry in entries[start:target]:
+            if entry.get("action") in HISTORY_ACTIONS:
+                # only actions after the snapshot can be undone, see play_game in tui.py for undoing whole phases
+                getattr(game, entry["action"])()
+            elif "action" in entry:
+                kwargs = dict(entry["kwargs"], outcome=entry["result"])
+                getattr(game, entry["action"])(*entry["args"], **kwargs)
+        return game
+
+    def truncate(self, label: str):
+        """Drops the phase with the given label and everything after it, e.g. to play on from a restored phase."""
+        entries = self._entries()
+        target = self._marker_index(entries, label)
+        for entry in entries[target:]:
+            if "phase" in entry and os.path.exists(self._snapshot_file(entry["phase"])):
+                os.remove(self._snapshot_file(entry["phase"]))
+        with open(self._log_file, "w") as f:
+            f.writelines(json.dumps(entry) + "\n" for entry in entries[:target])
+        self._num_phases = len(self.phases())
+
+    def clear(self):
+        """Drops all phases and snapshots, e.g. when a new game is started in the directory of an old one."""
+        if os.path.exists(self._log_file):
+            os.remove(self._log_file)
+        shutil.rmtree(self._snapshot_dir, ignore_errors=True)
+        self._num_phases = 0
+
+    def _snapshot_file(self, label: str) -> str:
+        return os.path.join(self._snapshot_dir, label + ".snap")
+
+    def _marker_index(self, entries: list, label: str) -> int:
+        markers = [i for i, entry in enumerate(entries) if entry.get("phase") == label]
+        if not markers:
+            raise KeyError("No phase %s in the log" % label)
+        return markers[-1]
+
+    def _entries(self) -> list:
+        if not os.path.exists(self._log_file):
+            return []
+        with open(self._log_file, "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def _append(self, entry: dict):
+        with open(self._log_file, "a") as f:
+            f.write(json.dumps(entry) + "\n")
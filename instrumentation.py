@@ -0,0 +1,82 @@
+import json
+import os
+import time
+import numpy as np
+
+# Every call of a game action (see game.action) produces an ActionRecord, which is passed to the observers that are
+# registered at the game with Game.add_observer. An observer is any callable that takes the record.
+
+
+class ActionRecord:
+    def __init__(self, action: str, args: tuple, kwargs: dict, result, seconds: float, worlds_before: int,
+                 worlds_after: int, world_bytes: int, entropy: float):
+        self.action = action
+        self.args = args
+        self.kwargs = kwargs
+        self.result = result
+        self.seconds = seconds
+        self.worlds_before = worlds_before
+        self.worlds_after = worlds_after
+        self.world_bytes = world_bytes  # bytes held by the world store after the action
+        self.entropy = entropy  # entropy of the role distribution after the action, see role_entropy
+        self.timestamp = time.time()
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+    def __repr__(self):
+        return "%s%s: %.2f ms, %d -> %d worlds, %.3f bits" % (self.action, self.args, 1e3 * self.seconds,
+                                                             self.worlds_before, self.worlds_after, self.entropy)
+
+
+def role_entropy(role_dist: np.ndarray) -> float:
+    """Sum over all players of the Shannon entropy (in bits) of their role, 0 once every role is known."""
+    p = role_dist[:, :-1]  # the last column is the dead flag, not a role
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return float(-np.where(p > 0, p * np.log2(p), 0).sum())
+
+
+class JsonLinesObserver:
+    """Appends every record as one line of JSON to a file."""
+
+    def __init__(self, filename: str):
+        self._filename = filename
+
+    def __call__(self, record: ActionRecord):
+        with open(self._filename, "a") as f:
+            f.write(json.dumps(record.to_dict(), default=str) + "\n")
+
+
+class PrometheusObserver:
+    """Keeps per-action totals and rewrites a file in the Prometheus text format after every record, e.g. for the
+    textfile collector of the node exporter.
+    """
+
+    def __init__(self, filename: str, prefix: str = "werewolf"):
+        self._filename = filename
+        self._prefix = prefix
+        self._calls = {}
+        self._seconds = {}
+        self._last = None
+
+    def __call__(self, record: ActionRecord):
+        self._calls[record.action] = self._calls.get(record.action, 0) + 1
+        self._seconds[record.action] = self._seconds.get(record.action, 0.0) + record.seconds
+        self._last = record
+        self._write()
+
+    def _write(self):
+        p = self._prefix
+        lines = ["# TYPE %s_action_calls_total counter" % p]
+        lines += ['%s_action_calls_total{action="%s"} %d' % (p, a, n) for a, n in sorted(self._calls.items())]
+        lines.append("# TYPE %s_action_seconds_total counter" % p)
+        lines += ['%s_action_seconds_total{action="%s"} %f' % (p, a, s) for a, s in sorted(self._seconds.items())]
+        for name, value in [("worlds", self._last.worlds_after), ("world_bytes", self._last.world_bytes),
+                            ("role_entropy_bits", self._last.entropy)]:
+            lines.append("# TYPE %s_%s gauge" % (p, name))
+            lines.append("%s_%s %s" % (p, name, value))
+        # written to a temporary file first, so scrapers never see a half written file
+        temp = self._filename + ".tmp"
+        with open(temp, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp, self._filename)
@@ -0,0 +1,255 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from game import Game, WW_KILL, SEER_CHECK
+from tui import dict_to_game_config, parse_action_players, role_names
+
+# Session server that hosts many games (tables) in one process. Clients connect to a local socket (Unix or TCP on
+# localhost) and send one JSON request per line, every request gets one JSON response line:
+#     {"id": 1, "game": "table1", "command": "create", "config": {...}}   configuration as written by tui.py
+#     {"id": 2, "game": "table1", "command": "kill", "players": ["Ann", "Bob"]}
+#     {"id": 3, "game": "table1", "command": "night", "actions": [["kill", "Ann", "Bob"], ["check", 3, "Dee"]]}
+# Commands are create, kill, check, lynch, night, dist, status, undo, redo, save and close (see SessionServer).
+# Players are given as in the batch mode of tui.py, by name or by their number in the menus.
+# The actions of a table run one after another, the game work runs in a thread pool, so a large night of one table
+# does not stall the others. Once the resident games take more memory than allowed, the least recently used ones are
+# written to snapshots in the state directory and loaded again by their next request. The undo history of a game is
+# lost when it is evicted.
+
+# game work that runs in the thread pool, the other commands only read the counts of the game
+_THREADED = {"kill", "check", "lynch", "night", "undo", "redo", "save"}
+_NIGHT_KINDS = {"kill": WW_KILL, "check": SEER_CHECK}
+
+
+class _Table:
+    def __init__(self, config: dict, game: Game = None):
+        self.config = config  # configuration in the format of tui.py
+        self.game = game  # None while the game is evicted
+        self.lock = asyncio.Lock()
+
+
+class SessionServer:
+    def __init__(self, state_dir: str, max_resident_bytes: int = None, workers: int = None):
+        """
+        :param state_dir: Directory of the configurations and snapshots of all games, games found there are served
+            again
+        :param max_resident_bytes: Bytes the worlds of the resident games may take, never evicts if None
+        :param workers: Threads of the pool the game work runs in
+        """
+        self._state_dir = state_dir
+        self._max_resident_bytes = max_resident_bytes
+        self._executor = ThreadPoolExecutor(workers)
+        self._tables = OrderedDict()  # name -> _Table, the least recently used first
+        self._eviction = None  # task of _evict_in_background while it runs
+        self._evict_again = False  # set by requests that finish while the eviction runs
+        os.makedirs(state_dir, exist_ok=True)
+        for filename in sorted(os.listdir(state_dir)):
+            name, extension = os.path.splitext(filename)
+            if extension == ".json" and os.path.exists(self._snapshot_file(name)):
+                with open(os.path.join(state_dir, filename), "r") as f:
+                    self._tables[name] = _Table(json.load(f))
+
+    async def handle(self, request: dict) -> dict:
+        """Runs a request and returns the response, {"error": message} if it failed."""
+        response = {"id": request.get("id")}
+        try:
+            name, command = request.get("game", ""), request.get("command")
+            if not re.fullmatch(r"[\w-]+", name):
+                raise ValueError("Invalid game name: %r" % name)
+            if command == "create":
+                response.update(await self._create(name, request["config"]))
+            else:
+                response.update(await self._run(name, command, request))
+        except Exception as e:  # e.g. InvalidAction, the server goes on with the other requests
+            response["error"] = "%s: %s" % (type(e).__name__, e)
+        self._schedule_eviction()
+        return response
+
+    async def serve_unix(self, path: str):
+        server = await asyncio.start_unix_server(self._client, path=path)
+        async with server:
+            await server.serve_forever()
+
+    async def serve_tcp(self, host: str, port: int):
+        server = await asyncio.start_server(self._client, host=host, port=port)
+        async with server:
+            await server.serve_forever()
+
+    async def close(self):
+        """Writes every resident game to its snapshot, so a new server goes on with all games."""
+        if self._eviction is not None:
+            await asyncio.gather(self._eviction, return_exceptions=True)
+        for table in list(self._tables.values()):
+            async with table.lock:
+                if table.game is not None:
+                    await self._in_thread(self._unload, table, self._name_of(table))
+        self._executor.shutdown()
+
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    response = {"id": None, "error": "Invalid request: %s" % e}
+                else:
+                    response = await self.handle(request)
+                writer.write((json.dumps(response) + "\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass  # the client went away, its requests are done anyway
+        finally:
+            writer.close()
+
+    async def _create(self, name: str, config: dict) -> dict:
+        if name in self._tables:
+            raise ValueError("Game %s already exists" % name)
+        table = _Table(config)
+        self._tables[name] = table
+        async with table.lock:
+            try:
+                table.game = await self._in_thread(Game, dict_to_game_config(config))
+            except Exception:
+                del self._tables[name]
+                raise
+            with open(self._config_file(name), "w") as f:
+                json.dump(config, f, indent=2)
+            return {"worlds": table.game.num_worlds()}
+
+    async def _run(self, name: str, command: str, request: dict) -> dict:
+        if name not in self._tables:
+            raise KeyError("No game %s" % name)
+        table = self._tables[name]
+        self._tables.move_to_end(name)
+        async with table.lock:
+            if command == "close":
+                if table.game is not None:
+                    table.game.close()
+                    table.game = None
+                del self._tables[name]
+                for filename in (self._config_file(name), self._snapshot_file(name)):
+                    if os.path.exists(filename):
+                        os.remove(filename)
+                return {}
+            if table.game is None:
+                table.game = await self._in_thread(Game.load_game, dict_to_game_config(table.config),
+                                                   self._snapshot_file(name))
+            if command in _THREADED:
+                return await self._in_thread(self._command, table, command, request)
+            return self._command(table, command, request)
+
+    def _command(self, table: _Table, command: str, request: dict) -> dict:
+        """Runs a command on the game of the table, see the protocol at the top of the module."""
+        game, config = table.game, table.config
+        # the actions are called by keyword, so nothing in a request can reach their outcome argument
+        if command in ("kill", "check"):
+            p1, p2 = parse_action_players(command, request.get("players"), game, config)
+            action = game.ww_kill if command == "kill" else game.seer_check
+            result = action(p1=p1, p2=p2)
+        elif command == "lynch":
+            player, = parse_action_players(command, request.get("players"), game, config)
+            result = game.lynch(player=player)
+        elif command == "night":
+            actions = request.get("actions")
+            if not isinstance(actions, list) or not all(isinstance(action, list) and len(action) == 3
+                                                        and action[0] in _NIGHT_KINDS for action in actions):
+                raise ValueError("The actions of a night are [kind, source, target] with kind kill or check")
+            result = game.resolve_night(night_actions=[
+                (_NIGHT_KINDS[action[0]], *parse_action_players(action[0], action[1:], game, config))
+                for action in actions])
+        elif command in ("undo", "redo"):
+            result = getattr(game, command)()
+        elif command == "save":
+            game.save_game(self._snapshot_file(self._name_of(table)))
+            result = None
+        elif command == "dist":
+            names = role_names(config) + ["DEAD"]
+            return {"role_dist": {player: dict(zip(names, row.tolist()))
+                                  for player, row in zip(config["players"], game._role_dist)}}
+        elif command == "status":
+            result = None
+        else:
+            raise ValueError("Unknown command: %s" % command)
+        return {"result": result, "worlds": game.num_worlds(), "winner": game.winner(),
+                "chances": game.faction_probabilities()}
+
+    def _schedule_eviction(self):
+        """Evicts games in a background task, so a response never waits for the snapshots of other games."""
+        if self._max_resident_bytes is None:
+            return
+        if self._eviction is None or self._eviction.done():
+            self._eviction = asyncio.create_task(self._evict_in_background())
+        else:
+            self._evict_again = True
+
+    async def _evict_in_background(self):
+        self._evict_again = True
+        while self._evict_again:
+            self._evict_again = False
+            await self._evict()
+
+    async def _evict(self):
+        """Writes the least recently used idle games to their snapshots until the resident ones fit the memory."""
+        if self._max_resident_bytes is None:
+            return
+        for name, table in list(self._tables.items()):
+            resident = [t.game._shards.nbytes for t in self._tables.values() if t.game is not None]
+            if sum(resident) <= self._max_resident_bytes or len(resident) <= 1:
+                break
+            if table.game is None or table.lock.locked():
+                continue
+            async with table.lock:
+                if table.game is not None and name in self._tables:
+                    await self._in_thread(self._unload, table, name)
+
+    def _unload(self, table: _Table, name: str):
+        table.game.save_game(self._snapshot_file(name))
+        table.game.close()
+        table.game = None
+
+    def _in_thread(self, f, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, f, *args)
+
+    def _name_of(self, table: _Table) -> str:
+        return next(name for name, t in self._tables.items() if t is table)
+
+    def _config_file(self, name: str) -> str:
+        return os.path.join(self._state_dir, name + ".json")
+
+    def _snapshot_file(self, name: str) -> str:
+        return os.path.join(self._state_dir, name + ".snap")
+
+
+async def main(args):
+    server = SessionServer(args.state_dir, None if args.max_memory is None else int(args.max_memory * 2 ** 20),
+                           args.workers)
+    try:
+        if args.socket is not None:
+            await server.serve_unix(args.socket)
+        else:
+            await server.serve_tcp("127.0.0.1", args.port)
+    finally:
+        await server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serves many games in one process over a local socket.")
+    parser.add_argument("--socket", help="path of a Unix socket, a TCP port on localhost is used if not given")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--state-dir", default="sessions", help="directory the games are evicted to")
+    parser.add_argument("--max-memory", type=float, default=None,
+                        help="megabytes the worlds of the resident games may take, see SessionServer")
+    parser.add_argument("--workers", type=int, default=None, help="threads the game work runs in")
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
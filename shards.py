@@ -0,0 +1,615 @@
+import weakref
+import numpy as np
+from common import Roles
+from worlds import sample_worlds, WorldStore, index_dtype, world_nbytes, packed_size, ROLE_DTYPE
+
+# The worlds of a game are split into shards. Every shard is a WorldShard that runs the steps of the game actions
+# (eliminations, dead flags, compaction, undo) on its own worlds and keeps the role counts of its worlds up to date.
+# The game only adds up the role counts of all shards and draws the random outcomes from the sum, so a game plays
+# exactly the same with any number of shards.
+# LocalShards runs a single shard in the process of the game. ShardPool runs one shard per worker process, the
+# worlds are held in shared memory, so the game process can still read them (e.g. to save the game).
+
+
+# status bits of a world, see WorldShard.status
+NO_WOLVES = 1
+WOLF_MAJORITY = 2
+# number of scratch masks of a shard (see WorldStore.mask_buffer) and of cached masks during a typical action (see
+# WorldShard._cached)
+NUM_MASKS = 3
+NUM_CACHED_MASKS = 4
+
+
+class HistoryEntry:
+    """What one action changed in a shard, enough to revert and repeat it (see WorldShard.undo and WorldShard.redo)
+    without a copy of the worlds: the dead flags it set and the move of the worlds that filtered out the eliminated
+    ones.
+    """
+
+    def __init__(self, num_worlds: int, counts: tuple):
+        self.dead = []  # (player, indices of the worlds where the player was set dead)
+        self.moves = None  # (holes, fillers) of the filter, see WorldStore.move
+        self.worlds_before = num_worlds
+        self.worlds_after = num_worlds
+        self.counts_before = counts  # see WorldShard._save_counts
+        self.counts_after = None
+
+    def changed(self) -> bool:
+        return bool(self.dead) or self.worlds_after != self.worlds_before
+
+
+class WorldShard:
+    """Runs the steps of the game actions on a WorldStore. Eliminated worlds are only marked during an action and
+    dropped by finish, see Game.action.
+    """
+
+    def __init__(self, world: WorldStore, num_roles: int, num_wolves: int):
+        self.world = world
+        self._num_roles = num_roles
+        self._num_wolves = num_wolves
+        self._roles = Roles(num_wolves)
+        # weighted number of worlds in which each player has each role (last column: is dead), kept up to date by
+        # _eliminate and _set_dead so that the role distribution never needs a pass over all worlds
+        self.role_counts = world.role_counts(num_roles)
+        self.total_weight = world.total_weight()
+        # number of alive wolves and alive other players of every world, kept up to date with the dead flags. They
+        # give the status of every world (see status), the weighted number of worlds with each status is kept in
+        # faction_counts.
+        counter_dtype = np.min_scalar_type(world.num_players)
+        world.add_column("alive_wolves", np.zeros(len(world), dtype=counter_dtype))
+        world.add_column("alive_others", np.zeros(len(world), dtype=counter_dtype))
+        self._count_alive(0, len(world))
+        self.faction_counts = self._faction_counts()
+        # mask of the worlds that survived the current action so far, None if nothing was eliminated yet.
+        # Eliminated worlds are only dropped from the world arrays once the action is done.
+        self._keep = None
+        # changes of the past actions, the last one is undone first. Undone actions move to _redo until the next
+        # action.
+        self._history = []
+        self._redo = []
+        self._change = None  # entry of the running action, created by its first change
+        # derived views of the worlds (wolf masks, dead flags, acting wolves), valid as long as the worlds stay at the
+        # same version. Every change of the roles, dead flags or order of the worlds bumps the version, see _cached.
+        self._version = 0
+        self._cache = {}
+        self._cache_version = 0
+
+    @staticmethod
+    def bytes_per_world(num_players: int, weighted: bool) -> int:
+        """Bytes a shard holds per world between actions: the world buffers, the alive counters, the scratch masks
+        and the cached views of an action.
+        """
+        counters = 2 * np.min_scalar_type(num_players).itemsize
+        acting_wolf = np.min_scalar_type(-num_players).itemsize
+        return world_nbytes(num_players, weighted) + counters + NUM_MASKS + NUM_CACHED_MASKS + acting_wolf
+
+    @staticmethod
+    def chunk_bytes_per_world(num_players: int) -> int:
+        """Bytes of the temporaries per world of a chunk, the largest are the role offsets and the unpacked dead
+        flags of WorldStore.role_counts.
+        """
+        return 18 * num_players + 16
+
+    # steps of the actions, see Game._ww_kill, Game._seer_check and Game._lynch
+
+    def attack(self, p1: int, p2: int):
+        """Drops the worlds where both players are wolves, player 2 dies where player 1 is the acting wolf."""
+        self._eliminate(np.logical_and(self._player_is_wolf(p1), self._player_is_wolf(p2)))
+        # sets player 2 dead in every world where p1 is the currently highest ranking werewolf
+        self._set_dead(p2, self.highest_ranking_werewolf() == p1)
+
+    def reveal(self, player: int, role: int):
+        """Drops the worlds where the player does not have the revealed role."""
+        self._eliminate(self.world.roles[:, player] != role)
+
+    def seer_result(self, p1: int, p2: int, evil: bool):
+        """Drops the worlds where player 1 is the seer and would have seen the other result for player 2."""
+        mask_p1_seer = self.world.roles[:, p1] == self._roles.SEER.value
+        mask_p2 = self._player_is_wolf(p2)
+        if evil:  # elim all universes where p2 is not evil (villager or seer)
+            mask_p2 = np.logical_not(mask_p2)
+        self._eliminate(np.logical_and(mask_p1_seer, mask_p2, out=mask_p1_seer))
+
+    def drop_dead(self, player: int):
+        """Drops the worlds where the player is already dead."""
+        self._eliminate(self._player_dead(player))
+
+    def drop_alive(self, player: int):
+        """Drops the worlds where the player is still alive."""
+        self._eliminate(np.logical_not(self._player_dead(player)))
+
+    def kill(self, player: int):
+        """Sets the player dead in every remaining world."""
+        self._set_dead(player)
+
+    def finish(self) -> bool:
+        """Drops the eliminated worlds from the world buffers.
+        :return: True if the running action changed anything in this shard
+        """
+        if self._keep is not None:
+            moves = self.world.filter(self._keep)
+            self._entry().moves = moves
+            self._keep = None
+            self._version += 1
+        if self._change is None:
+            return False
+        self._change.worlds_after = len(self.world)
+        return self._change.changed()
+
+    def commit(self, changed: bool):
+        """Ends the entry of the running action. If the action changed anything in any shard, every shard adds an
+        entry to its history (possibly an empty one), so the histories of all shards stay aligned.
+        """
+        entry = self._entry() if changed else None
+        self._change = None
+        if entry is None:
+            return
+        entry.worlds_after = len(self.world)
+        entry.counts_after = self._save_counts()
+        self._history.append(entry)
+        self._redo.clear()
+
+    def undo(self):
+        entry = self._history.pop()
+        if entry.moves is not None:
+            # the eliminated worlds are still behind the live ones, the swap of the filter brings them back
+            self.world.move(*entry.moves, entry.worlds_before)
+        for p, worlds in reversed(entry.dead):
+            self.world.clear_dead(p, worlds)
+            self._count_deaths(p, worlds, revived=True)
+        self._restore_counts(entry.counts_before)
+        self._redo.append(entry)
+        self._version += 1
+
+    def redo(self):
+        entry = self._redo.pop()
+        for p, worlds in entry.dead:
+            self.world.set_dead(p, worlds)
+            self._count_deaths(p, worlds)
+        if entry.moves is not None:
+            self.world.move(*entry.moves, entry.worlds_after)
+        self._restore_counts(entry.counts_after)
+        self._history.append(entry)
+        self._version += 1
+
+    def add_worlds(self, roles: np.ndarray, dead: np.ndarray) -> int:
+        """Adds new worlds (see sample_consistent_worlds) behind the live ones. The history of the shard is cleared, as
+        its dropped worlds are overwritten.
+        :return: Number of added worlds
+        """
+        self._history.clear()
+        self._redo.clear()
+        start = len(self.world)
+        num_added = self.world.append(roles, dead)
+        new = WorldStore(self.world.roles[start:], self.world.dead[start:])
+        new.chunk_size = self.world.chunk_size
+        self.role_counts = self.role_counts + new.role_counts(self._num_roles)
+        self.total_weight += num_added
+        self._count_alive(start, len(self.world))
+        self.faction_counts = self.faction_counts + self._faction_counts(slice(start, None))
+        self._version += 1
+        return num_added
+
+    # queries, they do not change the worlds
+
+    def status(self, worlds=None) -> np.ndarray:
+        """Status of the worlds (all or the ones selected by an index, mask or slice): bit 0 (NO_WOLVES) is set if
+        all wolves are dead, bit 1 (WOLF_MAJORITY) if at least as many wolves as other players are alive.
+        """
+        worlds = slice(None) if worlds is None else worlds
+        alive_wolves = self.world.column("alive_wolves")[worlds]
+        wolf_majority = alive_wolves >= self.world.column("alive_others")[worlds]
+        status = (alive_wolves == 0).view(np.uint8) * np.uint8(NO_WOLVES)
+        status |= wolf_majority.view(np.uint8) * np.uint8(WOLF_MAJORITY)
+        return status
+
+    def highest_ranking_werewolf(self) -> np.ndarray:
+        """Returns array with the highest ranking werewolf (the player that does the killing) per world, -1 if all
+        wolves are dead in that world. The array is cached and read-only.
+        """
+        return self._cached("acting_wolf", self._highest_ranking_werewolf)
+
+    def _highest_ranking_werewolf(self) -> np.ndarray:
+        highest_ranking_wolf = np.empty(len(self.world), dtype=np.min_scalar_type(-self.world.num_players))
+        for chunk in self.world.chunks():
+            # rank of every wolf (0 is the highest), other roles wrap around to the largest values of the unsigned
+            # type
+            ranks = self.world.roles[chunk] - self.world.roles.dtype.type(self._roles.WEREWOLF_FIRST.value)
+            dead = self.world.dead_matrix(chunk).view(np.uint8)
+            np.negative(dead, out=dead)  # dead players get all bits set, so they sort behind every alive wolf
+            ranks |= dead
+            acting = ranks.argmin(axis=1)
+            no_wolf_alive = np.take_along_axis(ranks, acting[:, None], axis=1)[:, 0] >= self._num_wolves
+            acting[no_wolf_alive] = -1
+            highest_ranking_wolf[chunk] = acting
+        return highest_ranking_wolf
+
+    # The previews return the counts (see subset_counts) of the worlds that would survive an outcome, see
+    # Game.preview_ww_kill and the like.
+
+    def preview_attack(self, p1: int, p2: int) -> tuple:
+        """Counts after attack(p1, p2) and the counts per role player 2 could reveal afterwards."""
+        survivors = np.logical_not(np.logical_and(self._player_is_wolf(p1), self._player_is_wolf(p2)))
+        counts, total, num_worlds = self.subset_counts(survivors)
+        newly_dead = self.highest_ranking_werewolf() == p1
+        newly_dead &= survivors
+        newly_dead &= np.logical_not(self._player_dead(p2))
+        counts[p2, -1] += self.world.total_weight(newly_dead)
+        return (counts, total, num_worlds), self._reveal_counts(p2, survivors)
+
+    def preview_seer_result(self, p1: int, p2: int) -> dict:
+        """Counts after seer_result(p1, p2, evil) for both results."""
+        p1_seer = self.world.roles[:, p1] == self._roles.SEER.value
+        previews = {}
+        for evil in (True, False):
+            mask_p2 = self._player_is_wolf(p2)
+            if evil:
+                mask_p2 = np.logical_not(mask_p2)
+            survivors = np.logical_and(p1_seer, mask_p2)
+            np.logical_not(survivors, out=survivors)
+            previews[evil] = self.subset_counts(survivors)
+        return previews
+
+    def preview_lynch(self, player: int) -> tuple:
+        """Counts after drop_dead(player) and the counts per role the player could reveal afterwards."""
+        alive = np.logical_not(self._player_dead(player))
+        return self.subset_counts(alive), self._reveal_counts(player, alive)
+
+    def subset_counts(self, worlds: np.ndarray) -> tuple:
+        """Returns the role counts (see WorldStore.role_counts), the total weight and the number of the worlds
+        selected by the mask, counting whichever of the selected or the other worlds are fewer.
+        """
+        num_worlds = int(np.count_nonzero(worlds))
+        if 2 * num_worlds <= len(self.world):
+            return self.world.role_counts(self._num_roles, worlds), self.world.total_weight(worlds), num_worlds
+        others = np.logical_not(worlds)
+        return (self.role_counts - self.world.role_counts(self._num_roles, others),
+                self.total_weight - self.world.total_weight(others), num_worlds)
+
+    def _reveal_counts(self, player: int, survivors: np.ndarray) -> dict:
+        """Counts of the survivors per role of the player, after which the player is dead."""
+        reveals = {}
+        for role in range(self._num_roles):
+            mask = self.world.roles[:, player] == role
+            mask &= survivors
+            counts, total, num_worlds = self.subset_counts(mask)
+            if num_worlds > 0:
+                counts[player, -1] = total
+                reveals[role] = (counts, total, num_worlds)
+        return reveals
+
+    # returns a mask of worlds where the player is a wolf, cached and read-only
+    def _player_is_wolf(self, p1: int) -> np.ndarray:
+        return self._cached(("wolf", p1), lambda: self.world.roles[:, p1] >= self._roles.WEREWOLF_FIRST.value)
+
+    # returns a mask of worlds where the player is dead, cached and read-only
+    def _player_dead(self, p: int) -> np.ndarray:
+        return self._cached(("dead", p), lambda: self.world.player_dead(p))
+
+    def _cached(self, key, compute) -> np.ndarray:
+        """Returns the view with the given key, computed only once per version of the worlds. Repeated queries
+        between two changes (e.g. a preview and the action after it) reuse it.
+        """
+        if self._cache_version != self._version:
+            self._cache.clear()
+            self._cache_version = self._version
+        view = self._cache.get(key)
+        if view is None:
+            view = compute()
+            view.flags.writeable = False  # shared by every caller
+            self._cache[key] = view
+        return view
+
+    def _entry(self) -> HistoryEntry:
+        if self._change is None:
+            self._change = HistoryEntry(len(self.world), self._save_counts())
+        return self._change
+
+    def _save_counts(self) -> tuple:
+        return self.role_counts.copy(), self.total_weight, self.faction_counts.copy()
+
+    def _restore_counts(self, counts: tuple):
+        self.role_counts, self.total_weight, self.faction_counts = counts[0].copy(), counts[1], counts[2].copy()
+
+    def _faction_counts(self, worlds=None) -> np.ndarray:
+        """Weighted number of worlds (all or the selected ones) with each status, see status."""
+        weights = self.world.weights
+        if weights is not None and worlds is not None:
+            weights = weights[worlds]
+        return np.bincount(self.status(worlds), weights=weights, minlength=4).astype(np.int64)
+
+    def _count_alive(self, start: int, stop: int):
+        """Counts the alive wolves and alive other players of the worlds [start, stop) into their columns."""
+        alive_wolves, alive_others = self.world.column("alive_wolves"), self.world.column("alive_others")
+        for chunk in self.world.chunks(start, stop):
+            alive = np.logical_not(self.world.dead_matrix(chunk))
+            is_wolf = self.world.roles[chunk] >= self._roles.WEREWOLF_FIRST.value
+            alive_wolves[chunk] = np.logical_and(alive, is_wolf, out=is_wolf).sum(axis=1)
+            alive_others[chunk] = alive.sum(axis=1) - alive_wolves[chunk]
+
+    def _count_deaths(self, p: int, worlds: np.ndarray, revived: bool = False):
+        """Updates the alive counters and the faction counts after player p died (or was revived by undo) in the
+        worlds with the given indices.
+        """
+        self.faction_counts -= self._faction_counts(worlds)
+        is_wolf = self.world.roles[worlds, p] >= self._roles.WEREWOLF_FIRST.value
+        update = np.add if revived else np.subtract
+        for name, selected in [("alive_wolves", worlds[is_wolf]), ("alive_others", worlds[np.logical_not(is_wolf)])]:
+            column = self.world.column(name)
+            column[selected] = update(column[selected], column.dtype.type(1))
+        self.faction_counts += self._faction_counts(worlds)
+
+    def _eliminate(self, mask_elim: np.ndarray):
+        """Eliminates the worlds where mask_elim is True and removes them from the role counts right away."""
+        removed = self.world.mask_buffer("removed")
+        if self._keep is None:
+            np.copyto(removed, mask_elim)
+        else:
+            np.logical_and(mask_elim, self._keep, out=removed)
+        num_removed = np.count_nonzero(removed)
+        if num_removed == 0:
+            return
+        self._entry()
+        if self._keep is None:
+            self._keep = self.world.mask_buffer("keep")
+            self._keep.fill(True)
+        num_kept = np.count_nonzero(self._keep)
+        np.logical_xor(self._keep, removed, out=self._keep)
+        if 2 * num_removed <= num_kept:
+            self.role_counts -= self.world.role_counts(self._num_roles, removed)
+            self.total_weight -= self.world.total_weight(removed)
+            self.faction_counts -= self._faction_counts(removed)
+        else:
+            # most worlds are dropped, counting the survivors is cheaper
+            self.role_counts = self.world.role_counts(self._num_roles, self._keep)
+            self.total_weight = self.world.total_weight(self._keep)
+            self.faction_counts = self._faction_counts(self._keep)
+
+    def _set_dead(self, p: int, worlds=None):
+        """Marks player p as dead in the worlds selected by the mask worlds (all worlds if None)."""
+        newly_dead = self.world.mask_buffer("newly_dead")
+        np.logical_not(self._player_dead(p), out=newly_dead)
+        if worlds is not None:
+            newly_dead &= worlds
+        if self._keep is not None:
+            newly_dead &= self._keep
+        indices = np.flatnonzero(newly_dead)
+        if len(indices) == 0:
+            return
+        self._entry().dead.append((p, indices.astype(index_dtype(self.world.capacity))))
+        self.role_counts[p, -1] += self.world.total_weight(newly_dead)
+        self.world.set_dead(p, newly_dead)
+        self._version += 1
+        self._count_deaths(p, indices)
+
+
+def sample_consistent_worlds(num_worlds: int, constraints: list, fixed: dict, role_dist: list, num_roles: int,
+                             num_wolves: int, rng: np.random.Generator, chunk_size: int = None,
+                             max_rounds: int = 16) -> tuple:
+    """Samples up to num_worlds new worlds that agree with everything that happened so far. Batches of worlds are
+    sampled with the known roles fixed and every step of the game is replayed on them, the worlds that survive are
+    kept. The worlds only depend on the generator, not on how the game is split into shards.
+    :param constraints: All steps of the game so far, (name of a method of WorldShard, arguments)
+    :param fixed: Revealed roles {player: role}, see sample_worlds
+    :return: (roles, dead) of the new worlds
+    """
+    num_players = sum(role_dist)
+    roles, dead = [], []
+    acceptance = 1.0
+    needed = num_worlds
+    for _ in range(max_rounds):
+        if needed == 0:
+            break
+        # batches are at most as large as the worlds of the game, so the memory of the game at most doubles for a
+        # moment. They do not depend on the chunk size, which only splits up the replay of the steps.
+        batch_size = int(min(max(needed / acceptance, 1024), num_worlds))
+        batch_worlds = sample_worlds(batch_size, num_players, num_roles, role_dist, rng, fixed=fixed)
+        batch_worlds.chunk_size = chunk_size
+        batch = WorldShard(batch_worlds, num_roles, num_wolves)
+        for name, args in constraints:
+            getattr(batch, name)(*args)
+        batch.finish()
+        survivors = batch.world
+        acceptance = max(len(survivors) / batch_size, 1e-4)
+        roles.append(survivors.roles[:needed])
+        dead.append(survivors.dead[:needed])
+        needed -= len(roles[-1])
+    if not roles:
+        return np.empty((0, num_players), dtype=ROLE_DTYPE), np.empty((0, packed_size(num_players)), dtype=np.uint8)
+    return np.concatenate(roles), np.concatenate(dead)
+
+
+class LocalShards:
+    """All worlds in a single shard in the process of the game."""
+
+    def __init__(self, world: WorldStore, num_roles: int, num_wolves: int):
+        self._shard = WorldShard(world, num_roles, num_wolves)
+
+    def __len__(self):
+        return len(self._shard.world)
+
+    @property
+    def nbytes(self) -> int:
+        return self._shard.world.nbytes
+
+    def call(self, name: str, *args) -> list:
+        """Runs the method of WorldShard with the given name on every shard, returns the list of their results."""
+        return [getattr(self._shard, name)(*args)]
+
+    def call_each(self, name: str, args: list) -> list:
+        """Like call, but every shard gets its own arguments, args holds a tuple per shard."""
+        return [getattr(self._shard, name)(*args[0])]
+
+    def free_space(self) -> list:
+        """Number of worlds every shard has room for behind its live worlds."""
+        return [self._shard.world.capacity - len(self._shard.world)]
+
+    def counts(self) -> tuple:
+        """Role counts, total weight and faction counts of all worlds, see WorldShard."""
+        return self._shard.role_counts, self._shard.total_weight, self._shard.faction_counts
+
+    def stores(self) -> list:
+        """The live worlds of every shard."""
+        return [self._shard.world]
+
+    def close(self):
+        pass
+
+
+class ShardPool:
+    """Splits the worlds into num_shards shards, each run by its own worker process. The buffers of the worlds are
+    shared memory, the workers operate on their part of them in place. The workers are spawned and import the main
+    module, so a script that creates sharded games needs an if __name__ == "__main__" guard.
+    """
+
+    def __init__(self, world: WorldStore, num_roles: int, num_wolves: int, num_shards: int):
+        # only imported by sharded games, it is a large part of the startup time otherwise
+        import multiprocessing
+        from multiprocessing import shared_memory
+        # the workers are started fresh instead of forked, a game may be created in a thread (e.g. by server.py) and
+        # forking a process with threads copies their locks in whatever state they are
+        context = multiprocessing.get_context("spawn")
+        self._blocks = {}
+        self._columns = {}
+        self._connections = []
+        self._workers = []
+        # registered before anything is created and filled as it goes, so whatever was started is released if a
+        # worker fails to start as well
+        blocks = []
+        self._finalizer = weakref.finalize(self, _shutdown, self._connections, self._workers, blocks)
+        # every shard gets an equal part of the buffers and of the live worlds, which are moved to the front of its
+        # part, so the free space (e.g. of a loaded game, see Game._replenish) is split evenly as well
+        self._bounds = np.linspace(0, world.capacity, num_shards + 1).astype(int)
+        live_bounds = np.linspace(0, len(world), num_shards + 1).astype(int)
+        for name, column in [("roles", world.roles), ("dead", world.dead), ("weights", world.weights)]:
+            if column is None:
+                continue
+            shape = (world.capacity,) + column.shape[1:]
+            block = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * column.itemsize, 1))
+            blocks.append(block)
+            self._blocks[name] = (block, shape, column.dtype)
+            self._columns[name] = np.ndarray(shape, dtype=column.dtype, buffer=block.buf)
+            for start, live_start, live_stop in zip(self._bounds, live_bounds[:-1], live_bounds[1:]):
+                self._columns[name][start:start + live_stop - live_start] = column[live_start:live_stop]
+        self._states = [None] * num_shards
+        try:
+            for index, (start, stop) in enumerate(zip(self._bounds[:-1], self._bounds[1:])):
+                connection, worker_connection = context.Pipe()
+                size = live_bounds[index + 1] - live_bounds[index]
+                worker = context.Process(target=_serve, daemon=True,
+                                         args=(worker_connection, self._blocks, start, stop, size, num_roles,
+                                               num_wolves, world.chunk_size))
+                worker.start()
+                self._connections.append(connection)
+                self._workers.append(worker)
+            # the workers answer every call with the state of their shard, starting with the initial one
+            self._receive()
+        except BaseException:
+            # e.g. EOFError of a worker that died while it set up its shard
+            self._finalizer()
+            raise
+
+    def __len__(self):
+        return sum(state[-1] for state in self._states)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self._columns.values())
+
+    def call(self, name: str, *args) -> list:
+        """Runs the method of WorldShard with the given name on all shards in parallel, returns the list of their
+        results.
+        """
+        for connection in self._connections:
+            connection.send((name, args))
+        return self._receive()
+
+    def call_each(self, name: str, args: list) -> list:
+        """Like call, but every shard gets its own arguments, args holds a tuple per shard."""
+        for connection, shard_args in zip(self._connections, args):
+            connection.send((name, shard_args))
+        return self._receive()
+
+    def free_space(self) -> list:
+        """Number of worlds every shard has room for behind its live worlds."""
+        return [stop - start - state[-1] for start, stop, state in zip(self._bounds[:-1], self._bounds[1:],
+                                                                       self._states)]
+
+    def counts(self) -> tuple:
+        # the reduction over the shards is a sum of a few P x (R + 1) matrices
+        return tuple(sum(state[i] for state in self._states) for i in range(3))
+
+    def stores(self) -> list:
+        """The live worlds of every shard, as views of the shared buffers."""
+        stores = []
+        for start, state in zip(self._bounds, self._states):
+            size = state[-1]
+            columns = {name: column[start:start + size] for name, column in self._columns.items()}
+            stores.append(WorldStore(columns["roles"], columns["dead"], columns.get("weights")))
+        return stores
+
+    def close(self):
+        """Stops the workers and frees the shared memory."""
+        self._columns = {}
+        self._finalizer()
+
+    def _receive(self) -> list:
+        results = []
+        error = None
+        # every worker is read, even after an error, so no answer is left in a pipe
+        for i, connection in enumerate(self._connections):
+            response = connection.recv()
+            if isinstance(response, Exception):
+                error = error or response
+                continue
+            result, state = response
+            self._states[i] = state  # role counts, total weight, faction counts, number of worlds
+            results.append(result)
+        if error is not None:
+            raise error
+        return results
+
+
+def _serve(connection, blocks: dict, start: int, stop: int, size: int, num_roles: int, num_wolves: int,
+           chunk_size: int):
+    """Main loop of a worker of a ShardPool, runs the calls of the pool on the shard of the buffers [start, stop).
+    :param blocks: (shared memory, shape, dtype) of every column of the worlds
+    :param size: Number of live worlds at the start of the shard
+    :param chunk_size: See WorldStore.chunk_size
+    """
+    columns = {name: np.ndarray(shape, dtype=dtype, buffer=block.buf)[start:stop]
+               for name, (block, shape, dtype) in blocks.items()}
+    world = WorldStore(columns["roles"], columns["dead"], columns.get("weights"), size)
+    world.chunk_size = chunk_size
+    shard = WorldShard(world, num_roles, num_wolves)
+    connection.send((None, _state(shard)))
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        name, args = message
+        try:
+            result = getattr(shard, name)(*args)
+        except Exception as e:
+            connection.send(e)
+            continue
+        connection.send((result, _state(shard)))
+
+
+def _state(shard: WorldShard) -> tuple:
+    return shard.role_counts, shard.total_weight, shard.faction_counts, len(shard.world)
+
+
+def _shutdown(connections: list, workers: list, blocks: list):
+    for connection in connections:
+        try:
+            connection.send(None)
+        except (OSError, ValueError):
+            pass
+    for worker in workers:
+        worker.join(timeout=5)
+        if worker.is_alive():
+            worker.terminate()
+    for block in blocks:
+        block.close()
+        block.unlink()
@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from common import GameConfig
+from game import Game, WW_KILL, SEER_CHECK, VILLAGERS, WOLVES
+
+# Headless simulation of complete games. Every player is driven by a policy that picks the targets of the night
+# actions and whom to lynch during the day. Games are fanned out over processes, each game gets its own RNG stream
+# spawned from a single seed, so a whole sweep is reproducible.
+
+
+def random_lynch(game: Game, alive: list, rng: np.random.Generator) -> int:
+    """Lynches a random player that is still alive."""
+    return int(rng.choice(alive))
+
+
+def random_wolf_target(game: Game, attacker: int, alive: list, rng: np.random.Generator) -> int:
+    """Attacks a random other player that is still alive."""
+    return int(rng.choice([p for p in alive if p != attacker]))
+
+
+def random_seer_target(game: Game, seer: int, alive: list, rng: np.random.Generator) -> int:
+    """Checks a random other player that is still alive."""
+    return int(rng.choice([p for p in alive if p != seer]))
+
+
+class Policy:
+    """Decides the actions of the players. Every decision is a function that gets the game, the acting player (not
+    for lynches), the players that are still alive and the RNG of the game and returns the target player.
+    Decisions must be picklable (e.g. module level functions) to run the games in worker processes.
+    """
+
+    def __init__(self, lynch=random_lynch, wolf_target=random_wolf_target, seer_target=random_seer_target):
+        self.lynch = lynch
+        self.wolf_target = wolf_target
+        self.seer_target = seer_target
+
+
+def alive_players(game: Game) -> list:
+    return [p for p in range(game._config.num_players) if not game.is_dead(p)]
+
+
+def play_game(config: GameConfig, policy: Policy, seed: np.random.SeedSequence, max_days: int) -> dict:
+    """Plays a complete game without any interaction, starting with the first night.
+    :return: Summary of the game (winner or None if not decided after max_days, days, remaining worlds)
+    """
+    game = Game(config, rng=seed)
+    # the decisions of the players have their own stream, the worlds and outcomes are drawn by the game
+    rng = game.spawn_rng()
+    day = 0
+    while day < max_days and not game.game_finished():
+        alive = alive_players(game)
+        if len(alive) < 2:
+            break
+        night_actions = []
+        for player in alive:
+            night_actions.append((WW_KILL, player, policy.wolf_target(game, player, alive, rng)))
+            night_actions.append((SEER_CHECK, player, policy.seer_target(game, player, alive, rng)))
+        # kills between two certain wolves are skipped, a moderator would reject them as well
+        game.resolve_night(night_actions)
+        day += 1
+        if game.game_finished():
+            break
+        alive = alive_players(game)
+        if not alive:
+            break
+        game.lynch(policy.lynch(game, alive, rng))
+    return {"winner": game.winner(), "days": day, "worlds": game.num_worlds()}
+
+
+def _play_games(config: GameConfig, policy: Policy, seeds: list, max_days: int) -> list:
+    return [play_game(config, policy, seed, max_days) for seed in seeds]
+
+
+def run_games(config: GameConfig, num_games: int, policy: Policy = None, seed=None, max_days: int = 50,
+              workers: int = None, games_per_task: int = 16) -> dict:
+    """
+    Plays num_games games on all cores and aggregates the results.
+    :param seed: Seed of the whole run, every game gets an independent stream spawned from it
+    :param workers: Number of worker processes, all cores if None, no worker processes if 1
+    :return: Aggregated statistics, see summarize
+    """
+    policy = policy or Policy()
+    seeds = np.random.SeedSequence(seed).spawn(num_games)
+    tasks = [seeds[i:i + games_per_task] for i in range(0, num_games, games_per_task)]
+    start = time.perf_counter()
+    if workers == 1:
+        results = [r for task in tasks for r in _play_games(config, policy, task, max_days)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_play_games, config, policy, task, max_days) for task in tasks]
+            results = [r for future in futures for r in future.result()]
+    return summarize(results, time.perf_counter() - start)
+
+
+def summarize(results: list, seconds: float) -> dict:
+    num_games = len(results)
+    winners = [r["winner"] for r in results]
+    return {
+        "games": num_games,
+        "seconds": seconds,
+        "games_per_second": num_games / seconds if seconds > 0 else float("inf"),
+        "villager_win_rate": winners.count(VILLAGERS) / num_games,
+        "wolf_win_rate": winners.count(WOLVES) / num_games,
+        "undecided_rate": winners.count(None) / num_games,
+        "mean_days": float(np.mean([r["days"] for r in results])),
+        "mean_worlds_left": float(np.mean([r["worlds"] for r in results])),
+        "collapse_rate": sum(r["worlds"] == 1 for r in results) / num_games,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Plays many games with random players and reports statistics.")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--worlds", type=int, default=10000)
+    parser.add_argument("--villagers", type=int, default=5)
+    parser.add_argument("--wolves", type=int, default=2)
+    parser.add_argument("--seers", type=int, default=1)
+    parser.add_argument("--world-mode", default="sample", choices=GameConfig.WORLD_MODES)
+    parser.add_argument("--min-worlds", type=int, default=None,
+                        help="replenish the worlds once fewer are left, see GameConfig")
+    parser.add_argument("--memory-budget", type=float, default=None,
+                        help="megabytes the worlds of every game may take, see GameConfig")
+    parser.add_argument("--max-days", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    num_players = args.villagers + args.wolves + args.seers
+    config = GameConfig(args.worlds, num_players, args.wolves, args.seers, args.villagers, args.world_mode,
+                        min_worlds=args.min_worlds,
+                        memory_budget=None if args.memory_budget is None else int(args.memory_budget * 2 ** 20))
+    stats = run_games(config, args.games, seed=args.seed, max_days=args.max_days, workers=args.workers)
+    print(json.dumps(stats, indent=2))
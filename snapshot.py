@@ -0,0 +1,144 @@
+import json
+import struct
+import numpy as np
+from worlds import WorldStore, ROLE_DTYPE, WEIGHT_DTYPE, packed_size
+
+# Snapshot file format of the worlds:
+#   magic (8 bytes) | header length (uint32, little endian) | JSON header | padding | sections
+# The header holds the shape of the worlds, caller defined metadata (e.g. day, phase and player names) and the
+# offset and length of every section. The role matrix is bit-packed with as many bits per role as the number of
+# roles needs, the dead flags are stored packed as in the WorldStore, the weights (if any) as uint32. Every section
+# is stored row by row, so a range of worlds can be read on its own from a memory map of the file.
+
+MAGIC = b"QWWSNAP1"
+_ALIGNMENT = 64
+_DEFAULT_CHUNK = 1 << 16
+
+
+def role_bits(num_roles: int) -> int:
+    """Number of bits needed to store a role index."""
+    return max(1, int(num_roles - 1).bit_length())
+
+
+def pack_roles(roles: np.ndarray, bits: int) -> np.ndarray:
+    """Packs a n x P role matrix into n rows of ceil(P * bits / 8) bytes."""
+    unpacked = np.unpackbits(roles[:, :, None], axis=2, count=bits, bitorder="little")
+    return np.packbits(unpacked.reshape(len(roles), -1), axis=1, bitorder="little")
+
+
+def unpack_roles(packed: np.ndarray, num_players: int, bits: int) -> np.ndarray:
+    """Inverse of pack_roles."""
+    unpacked = np.unpackbits(packed, axis=1, count=num_players * bits, bitorder="little")
+    return np.packbits(unpacked.reshape(len(packed), num_players, bits), axis=2, bitorder="little")[:, :, 0]
+
+
+def is_snapshot(filename: str) -> bool:
+    with open(filename, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def read_header(filename: str) -> dict:
+    """Reads only the header of a snapshot, e.g. to list states without touching the worlds."""
+    with open(filename, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a snapshot" % filename)
+        header_length, = struct.unpack("<I", f.read(4))
+        header = json.loads(f.read(header_length).decode("utf-8"))
+        header["data_start"] = _data_start(header_length)
+        return header
+
+
+def save_worlds(filename: str, world, num_roles: int, metadata: dict = None, chunk_size: int = _DEFAULT_CHUNK,
+                capacity: int = None):
+    """Writes the live worlds of the store as a snapshot, packing chunk_size worlds at a time.
+    :param world: WorldStore or list of WorldStore (e.g. the shards of a game), which are written one after another
+    :param capacity: Number of worlds the buffers of the loaded store get room for (see load_worlds), the number of
+        live worlds if None
+    """
+    stores = world if isinstance(world, list) else [world]
+    bits = role_bits(num_roles)
+    num_worlds, num_players = sum(len(store) for store in stores), stores[0].num_players
+    sections = {"roles": num_worlds * packed_size(num_players * bits), "dead": num_worlds * packed_size(num_players)}
+    if stores[0].weights is not None:
+        sections["weights"] = num_worlds * np.dtype(WEIGHT_DTYPE).itemsize
+    header = {"version": 1, "num_worlds": num_worlds, "num_players": num_players, "num_roles": num_roles,
+              "role_bits": bits, "capacity": max(capacity or 0, num_worlds), "metadata": metadata or {},
+              "sections": {}}
+    # offsets are relative to the start of the data, which follows the header at the next aligned position
+    offset = 0
+    for name, length in sections.items():
+        header["sections"][name] = [offset, length]
+        offset = _align(offset + length)
+    encoded = json.dumps(header).encode("utf-8")
+    data_start = _data_start(len(encoded))
+    with open(filename, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(encoded)))
+        f.write(encoded)
+        for name in sections:
+            f.seek(data_start + header["sections"][name][0])
+            for store in stores:
+                for start in range(0, len(store), chunk_size):
+                    if name == "roles":
+                        f.write(pack_roles(store.roles[start:start + chunk_size], bits).tobytes())
+                    else:
+                        f.write(getattr(store, name)[start:start + chunk_size].tobytes())
+        f.truncate()
+
+
+def iter_worlds(filename: str, chunk_size: int = _DEFAULT_CHUNK):
+    """Lazily yields (start, roles, dead, weights) for consecutive chunks of worlds from a memory map of the file.
+    weights is None if the worlds are not weighted.
+    """
+    header = read_header(filename)
+    sections = _map_sections(filename, header)
+    num_players, bits = header["num_players"], header["role_bits"]
+    for start in range(0, header["num_worlds"], chunk_size):
+        stop = start + chunk_size
+        weights = sections["weights"][start:stop] if "weights" in sections else None
+        yield start, unpack_roles(sections["roles"][start:stop], num_players, bits), sections["dead"][start:stop], \
+            weights
+
+
+def load_worlds(filename: str, chunk_size: int = _DEFAULT_CHUNK) -> WorldStore:
+    """Loads a snapshot into a new WorldStore with the capacity the snapshot was saved with. The file is memory mapped
+    and unpacked chunk by chunk straight into the buffers of the store, so it is never held in memory as a whole.
+    """
+    header = read_header(filename)
+    num_worlds, num_players = header["num_worlds"], header["num_players"]
+    # snapshots of older versions have no capacity, their stores were always full
+    capacity = header.get("capacity", num_worlds)
+    roles = np.empty((capacity, num_players), dtype=ROLE_DTYPE)
+    dead = np.empty((capacity, packed_size(num_players)), dtype=np.uint8)
+    weights = np.empty(capacity, dtype=WEIGHT_DTYPE) if "weights" in header["sections"] else None
+    for start, chunk_roles, chunk_dead, chunk_weights in iter_worlds(filename, chunk_size):
+        stop = start + len(chunk_roles)
+        roles[start:stop] = chunk_roles
+        dead[start:stop] = chunk_dead
+        if weights is not None:
+            weights[start:stop] = chunk_weights
+    return WorldStore(roles, dead, weights, num_worlds)
+
+
+def _map_sections(filename: str, header: dict) -> dict:
+    num_worlds = header["num_worlds"]
+    shapes = {"roles": (num_worlds, packed_size(header["num_players"] * header["role_bits"])),
+              "dead": (num_worlds, packed_size(header["num_players"])),
+              "weights": (num_worlds,)}
+    dtypes = {"roles": np.uint8, "dead": np.uint8, "weights": WEIGHT_DTYPE}
+    sections = {}
+    for name, (offset, length) in header["sections"].items():
+        if length == 0:
+            sections[name] = np.empty(shapes[name], dtype=dtypes[name])
+        else:
+            sections[name] = np.memmap(filename, dtype=dtypes[name], mode="r", offset=header["data_start"] + offset,
+                                       shape=shapes[name])
+    return sections
+
+
+def _data_start(header_length: int) -> int:
+    return _align(len(MAGIC) + 4 + header_length)
+
+
+def _align(offset: int) -> int:
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
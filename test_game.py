@@ -0,0 +1,58 @@
+import os
+import pytest
+from common import GameConfig
+from game import Game, InvalidAction
+
+# steps of a game of 10 players with 2 wolves, a game with min_worlds=3000 replenishes after most of them
+STEPS = [("ww_kill", (0, 3)), ("seer_check", (1, 4)), ("lynch", (5,)), ("ww_kill", (2, 6)), ("lynch", (7,)),
+         ("seer_check", (1, 2)), ("ww_kill", (0, 8))]
+
+
+def make_config(world_mode="sample", num_shards=1, min_worlds=None):
+    return GameConfig(4000, 10, 2, 1, 7, world_mode, seed=4, num_shards=num_shards, min_worlds=min_worlds)
+
+
+def state(game: Game) -> tuple:
+    return game.num_worlds(), game._role_counts.tolist(), game.winner()
+
+
+def play(game: Game, steps: list) -> list:
+    """Runs the steps, returns the result of every step and the state of the game after it."""
+    results = []
+    for name, args in steps:
+        try:
+            result = getattr(game, name)(*args)
+        except InvalidAction as e:
+            result = type(e).__name__
+        results.append((result, state(game)))
+    return results
+
+
+@pytest.mark.parametrize("num_shards", [1, 2])
+def test_snapshot_reload_replenishes_the_same(tmp_path, num_shards):
+    config = make_config(num_shards=num_shards, min_worlds=3000)
+    filename = os.path.join(tmp_path, "game.snap")
+    game = Game(config)
+    loaded = None
+    try:
+        play(game, STEPS[:2])
+        game.save_game(filename)
+        expected = play(game, STEPS[2:])
+        loaded = Game.load_game(config, filename)
+        assert play(loaded, STEPS[2:]) == expected
+    finally:
+        game.close()
+        if loaded is not None:
+            loaded.close()
+
+
+@pytest.mark.parametrize("name, args", [("lynch", (-1,)), ("lynch", (10,)), ("ww_kill", (0, -2)),
+                                        ("seer_check", (-1, 2)), ("preview_lynch", (-1,)),
+                                        ("preview_ww_kill", (0, 10)), ("preview_seer_check", (-1, 0))])
+def test_actions_reject_unknown_players(name, args):
+    game = Game(make_config())
+    before = state(game)
+    with pytest.raises(ValueError):
+        getattr(game, name)(*args)
+    assert state(game) == before
+    assert not any(game.is_dead(player) for player in range(10))
@@ -0,0 +1,72 @@
+import os
+import pytest
+from common import GameConfig
+from game import Game, InvalidAction
+from gamelog import GameLog, LOG_FILE, SNAPSHOT_DIR
+
+STEPS = [("ww_kill", (0, 3)), ("seer_check", (1, 4)), ("lynch", (5,)), ("ww_kill", (2, 6)), ("lynch", (7,)),
+         ("seer_check", (1, 2)), ("ww_kill", (0, 8))]
+
+
+def state(game: Game) -> tuple:
+    return game.num_worlds(), game._role_counts.tolist(), game.winner()
+
+
+def play_logged(game: Game, log: GameLog) -> dict:
+    """Runs the steps with a phase before every one of them, returns the state of the game at the start of every
+    phase.
+    """
+    game.add_observer(log)
+    live = {}
+    for i, (name, args) in enumerate(STEPS):
+        label = "%02d" % i
+        log.mark_phase(game, label)
+        live[label] = state(game)
+        try:
+            getattr(game, name)(*args)
+        except InvalidAction:
+            pass
+        if i == 3:
+            game.undo()
+            game.redo()
+    return live
+
+
+@pytest.mark.parametrize("min_worlds", [None, 3000])
+def test_log_restores_live_states(tmp_path, min_worlds):
+    config = GameConfig(4000, 10, 2, 1, 7, seed=4, min_worlds=min_worlds)
+    log = GameLog(str(tmp_path), snapshot_every=2)
+    live = play_logged(Game(config), log)
+    assert log.phases() == list(live)
+    assert os.listdir(os.path.join(tmp_path, SNAPSHOT_DIR))
+    for label, expected in live.items():
+        assert state(log.restore(config, label)) == expected
+
+
+def test_truncate_plays_on_from_a_phase(tmp_path):
+    config = GameConfig(4000, 10, 2, 1, 7, seed=4)
+    log = GameLog(str(tmp_path), snapshot_every=2)
+    live = play_logged(Game(config), log)
+    game = log.restore(config, "04")
+    log.truncate("04")
+    assert log.phases() == ["00", "01", "02", "03"]
+    assert GameLog(str(tmp_path)).phases() == log.phases()
+    game.add_observer(log)
+    log.mark_phase(game, "04")
+    game.lynch(9)
+    assert state(log.restore(config, "04")) == live["04"]
+
+
+def test_clear_starts_a_fresh_log(tmp_path):
+    config = GameConfig(4000, 10, 2, 1, 7, seed=4)
+    log = GameLog(str(tmp_path), snapshot_every=1)
+    play_logged(Game(config), log)
+    log.clear()
+    assert not GameLog.exists(str(tmp_path))
+    assert not os.path.exists(os.path.join(tmp_path, SNAPSHOT_DIR))
+    assert GameLog(str(tmp_path)).phases() == []
+    # the first phase of a reproducible game is rebuilt from the seed, not from a snapshot
+    game = Game(config)
+    game.add_observer(log)
+    log.mark_phase(game, "00")
+    assert os.listdir(tmp_path) == [LOG_FILE]
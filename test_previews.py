@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from common import GameConfig
+from game import Game
+
+# (preview, action, arguments) at the start of the game and after a kill, a check and a lynch
+CASES = [("preview_ww_kill", "ww_kill", (0, 3)), ("preview_seer_check", "seer_check", (1, 4)),
+         ("preview_lynch", "lynch", (5,)), ("preview_ww_kill", "ww_kill", (2, 6)),
+         ("preview_seer_check", "seer_check", (1, 2)), ("preview_lynch", "lynch", (6,))]
+
+
+def state(game: Game) -> tuple:
+    return game.num_worlds(), game._role_counts.tolist(), game._version
+
+
+def check_previews(game: Game, preview_name: str, action_name: str, args: tuple) -> list:
+    """Runs the action with the outcome of every preview and compares the game with the preview."""
+    before = state(game)
+    previews = getattr(game, preview_name)(*args)
+    # previews do not change the game
+    assert state(game) == before
+    assert sum(preview.probability for preview in previews) == pytest.approx(1.0)
+    for preview in previews:
+        result = getattr(game, action_name)(*args, outcome=preview.outcome)
+        assert result == preview.outcome
+        assert game.num_worlds() == preview.num_worlds
+        assert np.allclose(game._role_dist, preview.role_dist)
+        game.undo()
+    return previews
+
+
+@pytest.mark.parametrize("world_mode", GameConfig.WORLD_MODES)
+def test_previews_match_outcomes(world_mode):
+    game = Game(GameConfig(3000, 9, 2, 1, 6, world_mode, seed=3))
+    for preview_name, action_name, args in CASES:
+        check_previews(game, preview_name, action_name, args)
+        getattr(game, action_name)(*args)
+
+
+@pytest.mark.parametrize("world_mode", GameConfig.WORLD_MODES)
+def test_kill_preview_reveals_roles(world_mode):
+    game = Game(GameConfig(3000, 9, 2, 1, 6, world_mode, seed=3))
+    # player 3 is attacked by everyone else, the last attack kills them in every world and reveals their role
+    for attacker in (0, 1, 2, 4, 5, 6, 7):
+        game.ww_kill(attacker, 3)
+    previews = check_previews(game, "preview_ww_kill", "ww_kill", (8, 3))
+    assert len(previews) > 1 and None not in [preview.outcome for preview in previews]
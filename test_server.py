@@ -0,0 +1,65 @@
+import asyncio
+import os
+from game import Game
+from server import SessionServer
+from tui import dict_to_game_config
+
+CONFIG = {"num_worlds": 2000, "players": ["Ann", "Bob", "Cid", "Dee", "Eve", "Fay", "Gus"], "num_villagers": 4,
+          "num_wolves": 2, "num_seers": 1, "seed": 8}
+
+
+def run(server: SessionServer, *requests) -> list:
+    """Handles the requests one after another, then closes the server."""
+    async def handle_all():
+        responses = [await server.handle(request) for request in requests]
+        await server.close()
+        return responses
+    return asyncio.run(handle_all())
+
+
+def test_requests_are_checked(tmp_path):
+    server = SessionServer(str(tmp_path))
+    requests = [{"command": "create", "config": CONFIG},
+                {"command": "kill", "players": ["Ann"]},
+                {"command": "kill", "players": ["Ann", "Bob", "Cid"]},
+                {"command": "lynch", "players": ["Ann", 0]},
+                {"command": "check", "players": ["Ann", "Ann"]},
+                {"command": "kill", "players": "AnnBob"},
+                {"command": "night", "actions": [["kill", "Ann"]]},
+                {"command": "night", "actions": [["lynch", "Ann", "Bob"]]},
+                {"command": "night", "actions": [["kill", "Ann", "Bob"], ["check", "Cid", "Cid"]]},
+                {"command": "lynch", "players": ["Bob"]},
+                {"command": "kill", "players": ["Bob", "Cid"]},
+                {"command": "jump"},
+                {"command": "status", "game": "../t"}]
+    responses = run(server, *[dict({"game": "t"}, id=i, **request) for i, request in enumerate(requests)])
+    assert [response["id"] for response in responses if "error" in response] == [1, 2, 3, 4, 5, 6, 7, 8, 10, 11, 12]
+    # the failed night changed nothing, the lynch plays like the same lynch on its own
+    game = Game(dict_to_game_config(CONFIG))
+    assert responses[9]["result"] == game.lynch(1)
+    assert responses[9]["worlds"] == game.num_worlds()
+
+
+def test_evicted_games_play_on(tmp_path):
+    # room for the worlds of one game only
+    server = SessionServer(str(tmp_path), max_resident_bytes=1)
+
+    async def play():
+        responses = [await server.handle({"game": name, "command": "create", "config": dict(CONFIG, seed=seed)})
+                     for seed, name in enumerate(["t0", "t1"])]
+        await server._eviction
+        responses.append(await server.handle({"game": "t0", "command": "kill", "players": ["Ann", "Bob"]}))
+        await server._eviction
+        responses.append(await server.handle({"game": "t0", "command": "lynch", "players": ["Cid"]}))
+        evicted = os.path.exists(os.path.join(tmp_path, "t1.snap"))
+        await server.close()
+        return responses, evicted
+
+    responses, evicted = asyncio.run(play())
+    assert evicted
+    game = Game(dict_to_game_config(dict(CONFIG, seed=0)))
+    assert [response["result"] for response in responses[2:]] == [game.ww_kill(0, 1), game.lynch(2)]
+    assert responses[-1]["worlds"] == game.num_worlds()
+    # a new server goes on with the games of the old one
+    server = SessionServer(str(tmp_path))
+    assert run(server, {"game": "t0", "command": "status"})[0]["worlds"] == game.num_worlds()
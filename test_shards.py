@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+from common import GameConfig
+from game import Game, InvalidAction, WW_KILL, SEER_CHECK
+
+STEPS = [("ww_kill", (0, 3)), ("seer_check", (1, 4)), ("lynch", (5,)), ("ww_kill", (2, 6)), ("lynch", (7,)),
+         ("seer_check", (1, 2)), ("ww_kill", (0, 8))]
+
+
+def play(game: Game) -> list:
+    """Runs the steps and a night, returns the result of every step and the state of the game after it."""
+    results = []
+    steps = STEPS + [("resolve_night", ([(WW_KILL, 2, 9), (SEER_CHECK, 1, 9)],)), ("undo", ()), ("redo", ())]
+    for name, args in steps:
+        try:
+            result = getattr(game, name)(*args)
+        except InvalidAction as e:
+            result = type(e).__name__
+        results.append((result, game.num_worlds(), game._role_counts.tolist(), game.faction_probabilities()))
+    return results
+
+
+@pytest.mark.parametrize("world_mode", GameConfig.WORLD_MODES)
+def test_shards_play_the_same(world_mode):
+    results, worlds = [], []
+    for num_shards in (1, 3):
+        game = Game(GameConfig(4000, 10, 2, 1, 7, world_mode, seed=4, num_shards=num_shards))
+        try:
+            results.append(play(game))
+            # the same worlds, in any order, with how often each of them occurs
+            rows = np.concatenate([np.hstack([store.roles, store.dead]) for store in game._shards.stores()])
+            worlds.append(np.unique(rows, axis=0, return_counts=True))
+        finally:
+            game.close()
+    assert results[0] == results[1]
+    assert all(np.array_equal(single, sharded) for single, sharded in zip(*worlds))
+
+
+def test_replenished_shards_play_the_same():
+    results = []
+    for num_shards in (1, 2, 3):
+        game = Game(GameConfig(4000, 10, 2, 1, 7, seed=4, num_shards=num_shards, min_worlds=3000))
+        try:
+            results.append(play(game))
+            assert game._num_replenished > 0
+        finally:
+            game.close()
+    assert results[0] == results[1] == results[2]
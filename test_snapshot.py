@@ -0,0 +1,53 @@
+import os
+import numpy as np
+import pytest
+import snapshot
+from common import GameConfig
+from game import Game
+from worlds import sample_worlds, WorldStore, WEIGHT_DTYPE
+
+
+@pytest.mark.parametrize("num_roles", [2, 5, 8, 17, 200])
+def test_pack_roles_round_trip(num_roles):
+    bits = snapshot.role_bits(num_roles)
+    roles = np.random.default_rng(0).integers(0, num_roles, (100, 13), dtype=np.uint8)
+    packed = snapshot.pack_roles(roles, bits)
+    assert packed.shape == (100, (13 * bits + 7) // 8)
+    assert np.array_equal(snapshot.unpack_roles(packed, 13, bits), roles)
+
+
+@pytest.mark.parametrize("weighted", [False, True])
+def test_save_load_round_trip(tmp_path, weighted):
+    # 4 wolves, a seer and villagers are 6 roles, 3 bits per role
+    world = sample_worlds(1000, 12, 6, [7, 1, 1, 1, 1, 1], rng=0)
+    if weighted:
+        world = WorldStore(world.roles, weights=np.arange(1, 1001, dtype=WEIGHT_DTYPE))
+    world.set_dead(3, np.arange(1000) % 3 == 0)
+    world.set_dead(11, slice(0, 500))
+    filename = os.path.join(tmp_path, "worlds.snap")
+    snapshot.save_worlds(filename, [world, world], 6, {"day": 2}, chunk_size=77, capacity=3000)
+    header = snapshot.read_header(filename)
+    assert (header["num_worlds"], header["capacity"], header["role_bits"]) == (2000, 3000, 3)
+    assert header["metadata"] == {"day": 2}
+    loaded = snapshot.load_worlds(filename, chunk_size=101)
+    assert (len(loaded), loaded.capacity) == (2000, 3000)
+    for column in ("roles", "dead") + (("weights",) if weighted else ()):
+        assert np.array_equal(getattr(loaded, column), np.concatenate([getattr(world, column)] * 2))
+    starts = [start for start, _, _, _ in snapshot.iter_worlds(filename, chunk_size=300)]
+    assert starts == list(range(0, 2000, 300))
+
+
+@pytest.mark.parametrize("world_mode", GameConfig.WORLD_MODES)
+def test_loaded_game_plays_the_same(tmp_path, world_mode):
+    config = GameConfig(3000, 9, 4, 1, 4, world_mode, seed=1)
+    filename = os.path.join(tmp_path, "game.snap")
+    game = Game(config)
+    game.ww_kill(0, 5)
+    game.save_game(filename, {"day": 1})
+    loaded = Game.load_game(config, filename)
+    assert snapshot.read_header(filename)["role_bits"] == 3
+    for g in (game, loaded):
+        g.seer_check(4, 6)
+        g.lynch(7)
+    assert loaded.num_worlds() == game.num_worlds()
+    assert np.array_equal(loaded._role_counts, game._role_counts)
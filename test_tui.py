@@ -0,0 +1,48 @@
+import io
+import json
+import os
+import pytest
+from game import Game
+from gamelog import GameLog
+from tui import dict_to_game_config, run_batch
+
+CONFIG = {"name": "batch", "num_worlds": 2000, "players": ["Ann", "Bob", "Cid", "Dee", "Eve", "Fay", "Gus"],
+          "num_villagers": 4, "num_wolves": 2, "num_seers": 1, "seed": 8, "snapshot_every": 1}
+
+
+def batch(commands: str, **kwargs) -> tuple:
+    """Runs the commands on a new game, returns the number of errors and the records of the commands."""
+    out = io.StringIO()
+    num_errors = run_batch(Game(dict_to_game_config(CONFIG)), CONFIG, io.StringIO(commands), out, **kwargs)
+    return num_errors, [json.loads(line) for line in out.getvalue().splitlines()]
+
+
+def test_batch_rejects_invalid_players():
+    commands = ["kill Ann", "kill Ann Bob Cid", "kill Ann Ann", "check Ann Zed", "lynch 0", "lynch 8", "jump Ann",
+                "lynch Bob", "kill Bob Cid", "kill Ann Cid", "# a comment", "dist"]
+    num_errors, records = batch("\n".join(commands), save_phases=False)
+    assert [record["line"] for record in records if "error" in record] == [1, 2, 3, 4, 5, 6, 7, 9]
+    assert num_errors == 8
+    assert records[7]["phase"] == "01D" and records[9]["phase"] == "01N"
+    assert set(records[-1]["role_dist"]) == set(CONFIG["players"])
+
+
+def test_batch_logs_to_its_own_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    game_dir = os.path.join("games", "batch")
+    os.makedirs(game_dir)
+    with open(os.path.join(game_dir, "log.jsonl"), "w") as f:
+        f.write('{"phase": "00N"}\n')
+    commands = "kill Ann Bob\nlynch Cid\n"
+    assert batch(commands)[0] == 0
+    # the log of the game with the same name is left alone
+    assert GameLog(game_dir).phases() == ["00N"]
+    batch_dirs = os.listdir("batches")
+    assert len(batch_dirs) == 1 and batch_dirs[0].startswith("batch-")
+    assert GameLog(os.path.join("batches", batch_dirs[0])).phases() == ["00N", "01D"]
+    assert batch(commands, log_dir="replay")[0] == 0
+    assert GameLog("replay").phases() == ["00N", "01D"]
+    with pytest.raises(FileExistsError):
+        batch(commands, log_dir="replay")
+    with pytest.raises(FileExistsError):
+        batch(commands, log_dir=game_dir)
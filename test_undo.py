@@ -0,0 +1,57 @@
+import pytest
+from common import GameConfig
+from game import Game, InvalidAction
+
+STEPS = [("ww_kill", (0, 3)), ("seer_check", (1, 4)), ("lynch", (5,)), ("ww_kill", (2, 6)), ("lynch", (7,)),
+         ("seer_check", (1, 2)), ("ww_kill", (0, 8))]
+
+
+def state(game: Game) -> tuple:
+    return game.num_worlds(), game._role_counts.tolist(), game.winner(), game.faction_probabilities()
+
+
+def play(game: Game) -> list:
+    """Runs the steps, returns the state before the first action and after every action that was not invalid."""
+    states = [state(game)]
+    for name, args in STEPS:
+        try:
+            getattr(game, name)(*args)
+        except InvalidAction:
+            continue
+        states.append(state(game))
+    return states
+
+
+@pytest.mark.parametrize("world_mode", GameConfig.WORLD_MODES)
+def test_undo_redo_round_trip(world_mode):
+    game = Game(GameConfig(4000, 10, 2, 1, 7, world_mode, seed=4))
+    states = play(game)
+    assert game.history_position() == game.num_undoable_actions() == len(states) - 1
+    for expected in reversed(states[:-1]):
+        game.undo()
+        assert state(game) == expected
+    for expected in states[1:]:
+        game.redo()
+        assert state(game) == expected
+    with pytest.raises(IndexError):
+        game.redo()
+
+
+def test_action_drops_redo():
+    game = Game(GameConfig(4000, 10, 2, 1, 7, seed=4))
+    play(game)
+    game.undo()
+    game.lynch(9)
+    with pytest.raises(IndexError):
+        game.redo()
+
+
+def test_replenish_clears_history():
+    game = Game(GameConfig(4000, 10, 2, 1, 7, seed=4, min_worlds=3000))
+    play(game)
+    assert game._num_replenished > 0
+    assert game.history_position() > game.num_undoable_actions()
+    for _ in range(game.num_undoable_actions()):
+        game.undo()
+    with pytest.raises(IndexError):
+        game.undo()
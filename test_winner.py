@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+from common import GameConfig
+from game import Game, InvalidAction, VILLAGERS, WOLVES
+
+
+def recount(game: Game) -> dict:
+    """Fraction of the worlds each faction has won, counted from the roles and dead flags of every world."""
+    won = {VILLAGERS: 0, WOLVES: 0}
+    total = 0
+    for store in game._shards.stores():
+        alive = np.logical_not(store.dead_matrix())
+        wolves = np.logical_and(alive, store.roles >= game._roles.WEREWOLF_FIRST.value).sum(axis=1)
+        others = alive.sum(axis=1) - wolves
+        weights = np.ones(len(store)) if store.weights is None else store.weights
+        won[VILLAGERS] += weights[wolves == 0].sum()
+        won[WOLVES] += weights[np.logical_and(wolves > 0, wolves >= others)].sum()
+        total += weights.sum()
+    return {faction: count / total for faction, count in won.items()}
+
+
+@pytest.mark.parametrize("world_mode, min_worlds", [(world_mode, None) for world_mode in GameConfig.WORLD_MODES] +
+                         [("sample", 1500)])
+def test_faction_probabilities_match_worlds(world_mode, min_worlds):
+    game = Game(GameConfig(2000, 7, 2, 1, 4, world_mode, seed=6, min_worlds=min_worlds))
+    for name, args in [("ww_kill", (0, 1)), ("lynch", (2,)), ("ww_kill", (3, 4)), ("undo", ()), ("redo", ()),
+                       ("lynch", (5,)), ("ww_kill", (6, 0))]:
+        try:
+            getattr(game, name)(*args)
+        except InvalidAction:
+            pass
+        expected = recount(game)
+        assert game.faction_probabilities() == pytest.approx(expected)
+        winner = [faction for faction, fraction in expected.items() if fraction == 1.0]
+        assert game.winner() == (winner[0] if winner else None)
+        assert game.game_finished() == bool(winner)
+
+
+def test_villagers_win_once_the_wolves_are_lynched():
+    game = Game(GameConfig(2000, 7, 2, 1, 4, seed=6))
+    wolf = game._roles.WEREWOLF_FIRST.value
+    game.lynch(0, outcome=wolf)
+    assert game.winner() is None
+    game.lynch(1, outcome=wolf + 1)
+    assert game.winner() == VILLAGERS and game.game_finished()
+    assert game.faction_probabilities() == {VILLAGERS: 1.0, WOLVES: 0.0}
+
+
+def test_wolves_win_once_they_are_as_many_as_the_others():
+    game = Game(GameConfig(2000, 7, 2, 1, 4, seed=6))
+    # 2 wolves and 3 others are alive after two villagers are lynched, 2 wolves and 2 others after the seer
+    for player in range(2):
+        game.lynch(player, outcome=0)
+    assert game.winner() is None
+    game.lynch(2, outcome=1)
+    assert game.winner() == WOLVES and game.game_finished()
+    assert game.faction_probabilities() == {VILLAGERS: 0.0, WOLVES: 1.0}
@@ -1,12 +1,23 @@
+import argparse
+import functools
 import os
-import pandas as pd
-from game import Game
+import secrets
+import shlex
+import sys
+import time
+from game import Game, InvalidAction, WW_KILL, SEER_CHECK, SKIPPED, VILLAGERS, WOLVES
+from instrumentation import JsonLinesObserver
+from gamelog import GameLog
 from common import GameConfig, safe_pop, ensure_dir
 import json
 
 _ASSETS_FOLDER = "assets"
+# returned by a phase if the moderator wants to revert the previous phase
+_UNDO = "undo"
 
 
+# the assets are only read once they are shown, so starting the batch mode reads none of them
+@functools.lru_cache(maxsize=None)
 def load_asset(filename: str) -> str:
     asset = os.path.join(_ASSETS_FOLDER, filename)
     try:
@@ -17,9 +28,12 @@ def load_asset(filename: str) -> str:
     return ""
 
 
-_MENU_OVERVIEW_TEXT = load_asset("menu-overview.txt")
-_GAME_MENU_DAY_TEXT = load_asset("game_menu_day.txt")
-_GAME_MENU_NIGHT_TEXT = load_asset("game_menu_night.txt")
+_MENU_OVERVIEW = "menu-overview.txt"
+_GAME_MENU_DAY = "game_menu_day.txt"
+_GAME_MENU_NIGHT = "game_menu_night.txt"
+# escape codes of highlighted cells in role distributions, see format_table
+_HIGHLIGHT = "\033[1;31m"
+_RESET = "\033[0m"
 
 
 def empty():
@@ -43,15 +57,16 @@ def load_game():
         print("Wrong input value(s)")
         return
     game_dir = os.path.join("games", game)
-    states = []
-    i = 1
-    for state in os.listdir(game_dir):
-        # skip config
-        if "config" in state:
-            continue
-        print("(%02d) % s" % (i, state))
-        states.append(state)
-        i += 1
+    log = GameLog(game_dir) if GameLog.exists(game_dir) else None
+    if log is not None:
+        states = log.phases()
+    else:
+        # games of older versions saved the complete state at every phase, skip config
+        states = [state for state in os.listdir(game_dir) if "config" not in state]
+    for i, state in enumerate(states):
+        # only the header of a snapshot is read for the listing
+        header = log.snapshot_header(state) if log is not None else None
+        print("(%02d) % s%s" % (i + 1, state, "" if header is None else " (%d worlds)" % header["num_worlds"]))
     try:
         state_num = int(input("Please select a state: ")) - 1
         state = states[state_num]
@@ -63,7 +78,12 @@ def load_game():
     num_days = int(state[:2])
     night = state[2] == "N"
     config = dict_to_game_config(raw_cfg)
-    game = Game.load_game(config, os.path.join(game_dir, state))
+    if log is not None:
+        game = log.restore(config, state)
+        # the game goes on from the restored phase, the later phases are overwritten
+        log.truncate(state)
+    else:
+        game = Game.load_game(config, os.path.join(game_dir, state))
     play_game(game, raw_cfg, night, num_days)
 
 
@@ -74,7 +94,8 @@ def start_new_game():
         game_name = input("Enter name of game (names with the same name will be overwritten): ")
         # ask for number of worlds
         num_worlds = int(
-            input("Enter number of worlds (the less, the earlier the complete wavefunction collapse will happen): "))
+            input("Enter number of worlds (the less, the earlier the complete wavefunction collapse will happen, "
+                  "0 to use every distinct world exactly once): "))
         #
         i = 1
         name = "temp"
@@ -109,7 +130,10 @@ def start_new_game():
         "players": player_names,
         "num_villagers": num_villagers,
         "num_wolves": num_wolves,
-        "num_seers": num_seers
+        "num_seers": num_seers,
+        "world_mode": "exact" if num_worlds == 0 else "sample",
+        "seed": secrets.randbits(64),
+        "snapshot_every": 4
     }
     game_dir = os.path.join("games", game_name)
     ensure_dir(game_dir)
@@ -117,6 +141,8 @@ def start_new_game():
 
     with open(os.path.join(game_dir, "config"), "w+") as f:
         json.dump(game_config, f, indent=2)
+    # the phases of an old game with the same name would be mixed with the new ones
+    GameLog(game_dir).clear()
     print("Setup completed successfully.")
 
     # load game from config
@@ -125,32 +151,67 @@ def start_new_game():
 
 
 def dict_to_game_config(d: dict):
-    return GameConfig(d["num_worlds"], len(d["players"]), d["num_wolves"], d["num_seers"], d["num_villagers"])
+    return GameConfig(d["num_worlds"], len(d["players"]), d["num_wolves"], d["num_seers"], d["num_villagers"],
+                      d.get("world_mode", "sample"), d.get("seed"), d.get("num_shards", 1), d.get("min_worlds"),
+                      d.get("memory_budget"))
 
 
 def play_game(game: Game, game_config: dict, night: bool, num_day: int):
     print("Starting game!")
+    # keeps a record of every action (duration, remaining worlds, ...) to find out which action made a game slow
+    game.add_observer(JsonLinesObserver(os.path.join(game_config["game_dir"], "actions.jsonl")))
+    # the log of all actions with their outcomes replaces saving the whole state at every phase
+    log = GameLog(game_config["game_dir"], game_config.get("snapshot_every", 4))
+    game.add_observer(log)
+    # phases played in this session: (label, night, day, Game.history_position at its start)
+    phases = []
     # actually play the game
     # divide into day and night phases
     # include some measure of when the game is finished
     while True:
         print("Currently in phase %s at day %d" % ("Night" if night else "Day", num_day))
-        game.save_game(
-            os.path.join(game_config["game_dir"], "%02d%s_" % (num_day, "N" if night else "D") + game_config["name"]))
+        label = "%02d%s" % (num_day, "N" if night else "D")
+        log.mark_phase(game, label, {"day": num_day, "night": night, "players": game_config["players"]})
+        phases.append((label, night, num_day, game.history_position()))
+        result = night_phase(game, game_config) if night else day_phase(game, game_config)
+        if result == _UNDO:
+            night, num_day = undo_phase(game, log, phases)
+            continue
         if night:
-            night_phase(game, game_config)
             num_day += 1
-        if not night:
-            day_phase(game, game_config)
         # flip phase
         night = not night
         # check if game is finished
-    pass
+        if game.game_finished():
+            print("The game is over, the %s have won." % game.winner())
+            return
+        chances = game.faction_probabilities()
+        print("The villagers have won in %.1f%% of the worlds, the wolves in %.1f%%." % (100 * chances[VILLAGERS],
+                                                                                     100 * chances[WOLVES]))
+
+
+def undo_phase(game: Game, log: GameLog, phases: list):
+    """Reverts the actions of the phase before the current one, which is then played again.
+    :return: (night, day) of the phase to play next
+    """
+    label, night, num_day, _ = phases.pop()
+    # phases before a loaded state are not in the history of the game, nor are actions before the worlds were
+    # replenished
+    if not phases or phases[-1][3] < game.history_position() - game.num_undoable_actions():
+        print("Nothing to undo.")
+        log.truncate(label)
+        return night, num_day
+    label, night, num_day, num_actions = phases.pop()
+    while game.history_position() > num_actions:
+        print("Undid %s" % game.undo())
+    # the log goes on from the repeated phase as if the reverted actions never happened
+    log.truncate(label)
+    return night, num_day
 
 def night_phase(game: Game, game_config: dict):
     night_actions = []
     while True:
-        print(_GAME_MENU_NIGHT_TEXT)
+        print(load_asset(_GAME_MENU_NIGHT))
         command = input("Please input your next action: ")
         switcher = {
             "1": lambda: perform_ww_kill(game, game_config),
@@ -162,15 +223,19 @@ def night_phase(game: Game, game_config: dict):
             "7": None,
             "8": exit
         }
+        if command == "9":
+            return _UNDO
         action = switcher.get(command, empty)
         if action is not None:
             night_action = action()
             if night_action is not None:
                 night_actions.append(night_action)
         else:
-            # unrolls all actions
-            for act in night_actions:
-                act()
+            # resolves all actions in one pass over the worlds
+            results = game.resolve_night([act.as_night_action() for act in night_actions])
+            for act, result in zip(night_actions, results):
+                if result == SKIPPED:
+                    print("Skipped impossible action: %s" % act)
             break
 
 
@@ -181,7 +246,7 @@ def see_actions(actions: list):
 
 def day_phase(game: Game, game_config: dict):
     while True:
-        print(_GAME_MENU_DAY_TEXT)
+        print(load_asset(_GAME_MENU_DAY))
         command = input("Please input your next action: ")
         switcher = {
             "1": lambda: see_role_dist(game, game_config),
@@ -189,6 +254,8 @@ def day_phase(game: Game, game_config: dict):
             "3": None,
             "4": exit
         }
+        if command == "5":
+            return _UNDO
         action = switcher.get(command, empty)
         if action is not None:
             lynch_act = action()
@@ -200,11 +267,60 @@ def day_phase(game: Game, game_config: dict):
     pass
 
 
+def role_names(game_config: dict) -> list:
+    return ["VILLAGER", "SEER"] + ["WOLF %d" % (i + 1) for i in range(game_config["num_wolves"])]
+
+
 def see_role_dist(game: Game, game_config: dict):
-    wolf_names = ["WOLF %d" % (i + 1) for i in range(game_config["num_wolves"])]
-    df = pd.DataFrame(data=game._role_dist, index=game_config["players"],
-                      columns=(["VILLAGER", "SEER"] + wolf_names + ["DEAD"]))
-    print(df)
+    print_role_dist(game._role_dist, game_config)
+
+
+def print_role_dist(role_dist, game_config: dict):
+    """Prints the role distribution as a table. The configuration can ask to list the players with the highest wolf
+    probability first ("sort_by_wolf": true) and to highlight the columns of some roles ("highlight_roles", e.g.
+    ["SEER", "WOLF 1"]).
+    """
+    players = list(range(len(game_config["players"])))
+    if game_config.get("sort_by_wolf"):
+        wolf_columns = slice(2, 2 + game_config["num_wolves"])
+        players.sort(key=lambda p: -role_dist[p, wolf_columns].sum())
+    print(format_table([game_config["players"][p] for p in players], role_names(game_config) + ["DEAD"],
+                       [role_dist[p] for p in players], game_config.get("highlight_roles", ()),
+                       color=sys.stdout.isatty() and "NO_COLOR" not in os.environ))
+
+
+def format_table(rows: list, columns: list, values, highlight=(), color: bool = False) -> str:
+    """Formats a matrix of probabilities as a text table with a label per row and a header per column. The columns
+    named in highlight are printed in color if color is set, otherwise their headers are marked with a *.
+    """
+    cells = [["%.6f" % value for value in row] for row in values]
+    headers = [name if color or name not in highlight else "*%s*" % name for name in columns]
+    widths = [max([len(header)] + [len(row[i]) for row in cells]) for i, header in enumerate(headers)]
+    label_width = max([len(label) for label in rows] + [0])
+
+    def line(label, row):
+        fields = []
+        for name, field, width in zip(columns, row, widths):
+            field = field.rjust(width)
+            fields.append(_HIGHLIGHT + field + _RESET if color and name in highlight else field)
+        return label.ljust(label_width) + "  " + "  ".join(fields)
+
+    return "\n".join([line("", headers)] + [line(label, row) for label, row in zip(rows, cells)])
+
+
+def print_previews(previews: list, game_config: dict, describe):
+    """Prints every possible outcome of an action (see Game.preview_ww_kill and the like), describe turns an outcome
+    into text.
+    """
+    for preview in previews:
+        print("If %s (probability %.3f): %d worlds remain" % (describe(preview.outcome), preview.probability,
+                                                            preview.num_worlds))
+        print_role_dist(preview.role_dist, game_config)
+
+
+def describe_reveal(game_config: dict):
+    return lambda role: "no role is revealed" if role is None else "the role %s is revealed" % \
+        role_names(game_config)[role]
 
 
 def lynch(game: Game, game_config: dict):
@@ -219,11 +335,14 @@ def lynch(game: Game, game_config: dict):
         # include measure to check if player is dead or definitely not a wolf
     try:
         victim = int(input("Choose who to lynch: ")) - 1
-        if game.is_dead(victim):
+        if victim < 0 or victim >= len(game_config["players"]) or game.is_dead(victim):
             raise ValueError
     except ValueError:
         print("Wrong input value(s)")
         return None
+    print_previews(game.preview_lynch(victim), game_config, describe_reveal(game_config))
+    if input("Lynch %s? (y/n): " % game_config["players"][victim]).strip().lower() != "y":
+        return None
     return lambda: game.lynch(victim)
 
 
@@ -240,12 +359,17 @@ def perform_ww_kill(game: Game, game_config: dict):
     try:
         attacker = int(input("Choose attacker: ")) - 1
         target = int(input("Choose target: ")) - 1
-        if attacker == target or attacker < 0 or target < 0 or attacker > len(game_config["players"]) or target > len(
-                game_config["players"]) or game.is_dead(attacker) or game.is_dead(target):
+        if attacker == target or attacker < 0 or target < 0 or attacker >= len(game_config["players"]) or \
+                target >= len(game_config["players"]) or game.is_dead(attacker) or game.is_dead(target):
             raise ValueError
     except ValueError:
         print("Wrong input value(s)")
         return None
+    # from the current worlds, the actions queued before this one are not taken into account
+    try:
+        print_previews(game.preview_ww_kill(attacker, target), game_config, describe_reveal(game_config))
+    except InvalidAction:
+        print("Both players are wolves in every world, the kill will be skipped.")
     return WWKill(attacker, target, game, game_config)
 
 
@@ -262,12 +386,14 @@ def perform_seer_check(game: Game, game_config: dict):
     try:
         seer = int(input("Choose seer: ")) - 1
         target = int(input("Choose target: ")) - 1
-        if seer == target or seer < 0 or target < 0 or seer > len(game_config["players"]) or target > len(
-                game_config["players"]) or game.is_dead(target) or game.is_dead(seer):
+        if seer == target or seer < 0 or target < 0 or seer >= len(game_config["players"]) or \
+                target >= len(game_config["players"]) or game.is_dead(target) or game.is_dead(seer):
             raise ValueError
     except ValueError:
         print("Wrong input value(s).")
         return
+    print_previews(game.preview_seer_check(seer, target), game_config,
+                   lambda evil: "the target is seen as %s" % ("evil" if evil else "good"))
     return SeerCheck(seer, target, game, game_config)
 
 
@@ -281,8 +407,14 @@ class NightAction:
     def translate_player(self, num):
         return self._game_config["players"][num]
 
+    def as_night_action(self):
+        """Returns the action in the form that Game.resolve_night takes."""
+        return self.kind, self._source, self._target
+
 
 class WWKill(NightAction):
+    kind = WW_KILL
+
     def __init__(self, source, target, game: Game, game_config: dict):
         super().__init__(source, target, game, game_config)
 
@@ -294,6 +426,8 @@ class WWKill(NightAction):
 
 
 class SeerCheck(NightAction):
+    kind = SEER_CHECK
+
     def __init__(self, source, target, game: Game, game_config: dict):
         super().__init__(source, target, game, game_config)
 
@@ -306,7 +440,7 @@ class SeerCheck(NightAction):
 
 def overview_menu():
     while True:
-        print(_MENU_OVERVIEW_TEXT)
+        print(load_asset(_MENU_OVERVIEW))
         command = input("Please input your next action: ")
         # dispatches on input to different functions
         switcher = {
@@ -322,5 +456,128 @@ def overview_menu():
             break
 
 
+# directory of the logs of the batch mode, every run gets its own one (see run_batch)
+_BATCH_FOLDER = "batches"
+# commands of the batch mode (see run_batch) with the number of players they take
+_BATCH_ACTIONS = {"kill": 2, "check": 2, "lynch": 1}
+
+
+def parse_player(word: str, game_config: dict) -> int:
+    """Index of a player given by name or by the number shown in the menus (starting at 1)."""
+    players = game_config["players"]
+    if word in players:
+        return players.index(word)
+    if word.isdigit() and 1 <= int(word) <= len(players):
+        return int(word) - 1
+    raise ValueError("Unknown player: %s" % word)
+
+
+def parse_action_players(command: str, words: list, game: Game, game_config: dict) -> list:
+    """Players of a kill, check or lynch of the batch mode (see parse_player), raises ValueError if they do not fit
+    the action.
+    """
+    if not isinstance(words, list) or len(words) != _BATCH_ACTIONS[command]:
+        raise ValueError("%s takes %d players" % (command, _BATCH_ACTIONS[command]))
+    players = [parse_player(str(word), game_config) for word in words]
+    if command != "lynch" and (players[0] == players[1] or any(game.is_dead(p) for p in players)):
+        raise ValueError("The players must be two different alive players")
+    return players
+
+
+def run_batch(game: Game, game_config: dict, commands, out=sys.stdout, save_phases: bool = True,
+              log_dir: str = None) -> int:
+    """Runs commands on the game without any prompts and writes one line of JSON per command to out. Commands are
+    lines of text (e.g. a file or sys.stdin), players are given by name or by their number in the menus:
+        kill <attacker> <target>    the attacker kills the target (see Game.ww_kill)
+        check <seer> <target>       the seer checks the target (see Game.seer_check)
+        lynch <player>              see Game.lynch
+        dist                        role distribution of every player
+        save <file>                 writes a snapshot of the worlds (see Game.save_game)
+    Kills and checks belong to the night and lynches to the day, a command of the other kind starts the next phase.
+    If save_phases is set, the phases are logged and saved as in play_game, to log_dir or to a new directory in
+    batches/ if None. The directory of a game (or of an earlier run) is never written to, as the log of a batch
+    starts at the first night again.
+    :return: Number of commands that failed
+    """
+    log = None
+    if save_phases:
+        if log_dir is None:
+            log_dir = os.path.join(_BATCH_FOLDER, "%s-%s" % (game_config["name"], time.strftime("%Y%m%d-%H%M%S")))
+        if GameLog.exists(log_dir):
+            raise FileExistsError("%s already holds the log of a game" % log_dir)
+        ensure_dir(log_dir)
+        game.add_observer(JsonLinesObserver(os.path.join(log_dir, "actions.jsonl")))
+        log = GameLog(log_dir, game_config.get("snapshot_every", 4))
+        game.add_observer(log)
+    actions = {"kill": game.ww_kill, "check": game.seer_check, "lynch": game.lynch}
+    night, num_day, phase = True, 0, None
+    num_errors = 0
+    for line_number, line in enumerate(commands, 1):
+        words = shlex.split(line, comments=True)
+        if not words:
+            continue
+        command, args = words[0], words[1:]
+        record = {"line": line_number, "command": command, "args": args}
+        start = time.perf_counter()
+        try:
+            if command in _BATCH_ACTIONS:
+                players = parse_action_players(command, args, game, game_config)
+                if night != (command != "lynch"):
+                    if night:
+                        num_day += 1
+                    night = not night
+                label = "%02d%s" % (num_day, "N" if night else "D")
+                if label != phase:
+                    if log is not None:
+                        log.mark_phase(game, label, {"day": num_day, "night": night, "players": game_config["players"]})
+                    phase = label
+                record.update(phase=phase, result=actions[command](*players), worlds=game.num_worlds(),
+                              winner=game.winner())
+            elif command == "dist":
+                names = role_names(game_config) + ["DEAD"]
+                record["role_dist"] = {player: dict(zip(names, row.tolist()))
+                                       for player, row in zip(game_config["players"], game._role_dist)}
+            elif command == "save":
+                if len(args) != 1:
+                    raise ValueError("save takes a file name")
+                game.save_game(args[0])
+            else:
+                raise ValueError("Unknown command: %s" % command)
+        except ValueError as e:  # also InvalidAction
+            num_errors += 1
+            record["error"] = str(e)
+        record["seconds"] = time.perf_counter() - start
+        out.write(json.dumps(record) + "\n")
+    return num_errors
+
+
+def batch_main(args) -> int:
+    with open(args.batch, "r") as f:
+        game_config = json.load(f)
+    game = Game(dict_to_game_config(game_config))
+    try:
+        if args.commands is None:
+            return run_batch(game, game_config, sys.stdin, save_phases=not args.no_save, log_dir=args.log_dir)
+        with open(args.commands, "r") as f:
+            return run_batch(game, game_config, f, save_phases=not args.no_save, log_dir=args.log_dir)
+    except FileExistsError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        game.close()
+
+
 if __name__ == '__main__':
-    overview_menu()
+    parser = argparse.ArgumentParser(description="Moderates a game of werewolf, interactively or from a script.")
+    parser.add_argument("--batch", metavar="CONFIG",
+                        help="configuration of a game (see start_new_game), runs the commands of --commands on it "
+                             "without any prompts, see run_batch")
+    parser.add_argument("--commands", help="file with one command per line, read from stdin if not given")
+    parser.add_argument("--no-save", action="store_true", help="neither logs nor saves the phases in batch mode")
+    parser.add_argument("--log-dir", help="new directory the phases of the batch mode are logged to, a directory in "
+                                          "batches/ named after the game and the time if not given")
+    args = parser.parse_args()
+    if args.batch is None:
+        overview_menu()
+    else:
+        sys.exit(1 if batch_main(args) else 0)
@@ -1,45 +1,300 @@
-from enum import Enum
 from typing import List
-from common import Roles
+from math import factorial
+import itertools
 import numpy as np
-import random
 
 # Layout of the worlds:
-# The whole game is a NxPxR tensor, with N being the number of worlds, P being the amount of players and R being
-# the number of roles available. The roles are one-hot encoded, that means if we are in world 1, player 1, the
-# role vector is vector that has a 1 at the corresponding role they have.
+# The whole game is a set of N worlds over P players. Instead of one-hot encoding the roles in a NxPx(R+1) float
+# tensor, every world stores a single small integer per player, the index of the role the player has in that world
+# (see common.Roles). Whether a player is dead is kept separately as a bitmask with 8 players packed into one byte,
+# so the dead flags of a world take ceil(P / 8) bytes.
+# Worlds can optionally carry a multiplicity weight. Weighted worlds are used when identical worlds are merged into a
+# single row or when all distinct worlds are enumerated, all statistics of the game are then weighted means.
 
-def sample_worlds(N: int, P: int, R: int, role_dist: List[int]) -> np.ndarray:
+ROLE_DTYPE = np.uint8
+WEIGHT_DTYPE = np.uint32
+
+
+def sample_worlds(N: int, P: int, R: int, role_dist: List[int], rng=None, chunk_size: int = None,
+                  fixed: dict = None) -> "WorldStore":
     """
     :param N: Number of worlds
     :param P: Number of players
     :param R: Number of roles (exclude the 'DEAD' role)
     :param role_dist: Distribution of roles (e.g. role 1 has 4 members, role 2 has 1 member, role 3 has 1 member
     -> we would pass the list [4, 1, 1]. Exclude 'DEAD' role
-    :return: Sampled world array (size N x P x (R + 1))
+    :param rng: np.random.Generator or seed used for sampling, a fresh unseeded generator if None
+    :param chunk_size: Number of worlds that are filled at once, all of them if None
+    :param fixed: Roles that are already known {player: role}, the other roles are permuted among the other players
+    :return: Sampled worlds (N worlds with P players each, nobody is dead yet)
     """
-    worlds = np.zeros([N, P, R + 1])
     assert sum(role_dist) == P, "The role distribution was not valid"
-    for n in range(N):
-        one_hot_roles = np.hstack((one_hot_from_role_dist(role_dist), np.zeros((P, 1))))
-        worlds[n, :, :] = one_hot_roles
-    return worlds
+    assert R <= np.iinfo(ROLE_DTYPE).max, "Too many roles for the role encoding"
+    rng = np.random.default_rng(rng)
+    fixed = fixed or {}
+    free_dist = list(role_dist)
+    for role in fixed.values():
+        free_dist[role] -= 1
+    assert min(free_dist) >= 0, "The fixed roles do not match the role distribution"
+    free = [p for p in range(P) if p not in fixed]
+    # holds the number of the role x times, according to role_dist
+    role_encoding = np.repeat(np.arange(len(role_dist), dtype=ROLE_DTYPE), free_dist)
+    roles = np.empty([N, P], dtype=ROLE_DTYPE)
+    chunk_size = chunk_size or max(N, 1)
+    for start in range(0, N, chunk_size):
+        chunk = roles[start:start + chunk_size]
+        if not fixed:
+            chunk[:] = role_encoding
+            # shuffles every row independently and in place, so every world is a uniform permutation of the roles
+            rng.permuted(chunk, axis=1, out=chunk)
+            continue
+        free_roles = np.empty((len(chunk), len(free)), dtype=ROLE_DTYPE)
+        free_roles[:] = role_encoding
+        rng.permuted(free_roles, axis=1, out=free_roles)
+        chunk[:, free] = free_roles
+        for player, role in fixed.items():
+            chunk[:, player] = role
+    return WorldStore(roles)
 
 
-def one_hot_from_role_dist(role_dist) -> np.ndarray:
-    i = 0
-    # holds the number of the role x times, according to role_dist
-    role_encoding = []
+def num_distinct_worlds(role_dist: List[int]) -> int:
+    """Number of distinct role assignments for the given role distribution (multinomial coefficient)."""
+    num = factorial(sum(role_dist))
     for num_role in role_dist:
-        role_encoding.extend([i] * num_role)
-        i += 1
-    random.shuffle(role_encoding)  # mutates in place
-    one_hot_roles = one_hot_encode(np.array(role_encoding))
-    return one_hot_roles
+        num //= factorial(num_role)
+    return num
+
+
+def enumerate_worlds(P: int, R: int, role_dist: List[int]) -> "WorldStore":
+    """
+    Enumerates every distinct role assignment exactly once. As the sampled worlds are uniform permutations of the
+    roles, every distinct world is equally likely and all of them get the weight 1.
+    :param P: Number of players
+    :param R: Number of roles (exclude the 'DEAD' role)
+    :param role_dist: Distribution of roles, see sample_worlds
+    :return: All distinct worlds (num_distinct_worlds(role_dist) worlds with P players each, nobody is dead yet)
+    """
+    assert sum(role_dist) == P, "The role distribution was not valid"
+    assert R <= np.iinfo(ROLE_DTYPE).max, "Too many roles for the role encoding"
+    # the most common role (usually the villagers) is not placed explicitly but fills the remaining slots
+    fill_role = int(np.argmax(role_dist))
+    unassigned = np.iinfo(ROLE_DTYPE).max
+    roles = np.full((1, P), unassigned, dtype=ROLE_DTYPE)
+    num_free = P
+    for role, num_role in enumerate(role_dist):
+        if role == fill_role or num_role == 0:
+            continue
+        # every partial world has the same number of free slots, so the slot choices are shared by all of them
+        choices = np.array(list(itertools.combinations(range(num_free), num_role)), dtype=np.intp)
+        free_slots = np.nonzero(roles == unassigned)[1].reshape(len(roles), num_free)
+        roles = np.repeat(roles, len(choices), axis=0)
+        slots = free_slots[:, choices].reshape(len(roles), num_role)
+        np.put_along_axis(roles, slots, role, axis=1)
+        num_free -= num_role
+    roles[roles == unassigned] = fill_role
+    assert len(roles) == num_distinct_worlds(role_dist), "Internal logical error"
+    return WorldStore(roles, weights=np.ones(len(roles), dtype=WEIGHT_DTYPE))
+
+
+def packed_size(P: int) -> int:
+    """Number of bytes needed to hold one dead flag per player."""
+    return (P + 7) // 8
+
+
+def world_nbytes(P: int, weighted: bool = False) -> int:
+    """Bytes of the buffers of a single world with P players in a WorldStore, without added columns."""
+    weight_bytes = np.dtype(WEIGHT_DTYPE).itemsize if weighted else 0
+    return P * np.dtype(ROLE_DTYPE).itemsize + packed_size(P) + weight_bytes
+
+
+def index_dtype(capacity: int):
+    """Smallest unsigned type that holds the index of every world in a store of the given capacity."""
+    return np.uint32 if capacity <= np.iinfo(np.uint32).max else np.uint64
+
+
+class WorldStore:
+    """Holds the role index of every player in every world (N x P) and the packed dead flags (N x ceil(P / 8)).
+    The arrays are fixed buffers, only the first len(self) rows hold live worlds. Filtering moves the survivors to the
+    front in place, so the store never allocates a second copy of the worlds.
+    """
+
+    def __init__(self, roles: np.ndarray, dead: np.ndarray = None, weights: np.ndarray = None, size: int = None):
+        """The arrays are the buffers of the store, only their first size rows (all if None) hold live worlds."""
+        self.num_players = roles.shape[1]
+        if dead is None:
+            dead = np.zeros((roles.shape[0], packed_size(self.num_players)), dtype=np.uint8)
+        # buffers of all per-world data, "weights" holds the multiplicity of every world and is missing if every
+        # world counts once
+        self._columns = {"roles": roles, "dead": dead}
+        if weights is not None:
+            self._columns["weights"] = weights
+        self._size = roles.shape[0] if size is None else size
+        # scratch masks that are reused between actions, see mask_buffer
+        self._masks = {}
+        # number of worlds that role_counts and the like process at once, bounds the size of their temporaries. None
+        # processes all worlds at once.
+        self.chunk_size = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def roles(self) -> np.ndarray:
+        return self._columns["roles"][:self._size]
+
+    @property
+    def dead(self) -> np.ndarray:
+        return self._columns["dead"][:self._size]
+
+    @property
+    def weights(self):
+        return self._columns["weights"][:self._size] if "weights" in self._columns else None
+
+    @property
+    def capacity(self) -> int:
+        return self._columns["roles"].shape[0]
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the world buffers and the scratch masks."""
+        return sum(column.nbytes for column in self._columns.values()) + sum(m.nbytes for m in self._masks.values())
+
+    def add_column(self, name: str, values: np.ndarray):
+        """Adds a per-world column (e.g. derived data that is kept up to date by the caller), which is moved along
+        with the worlds by filter, move and append.
+        """
+        column = np.zeros(self.capacity, dtype=values.dtype)
+        column[:self._size] = values
+        self._columns[name] = column
+
+    def column(self, name: str) -> np.ndarray:
+        """Live part of a column added with add_column."""
+        return self._columns[name][:self._size]
+
+    def chunks(self, start: int = 0, stop: int = None):
+        """Slices of the live worlds (or of the worlds [start, stop)) in chunks of chunk_size worlds."""
+        stop = self._size if stop is None else stop
+        chunk_size = self.chunk_size or max(stop - start, 1)
+        for chunk_start in range(start, stop, chunk_size):
+            yield slice(chunk_start, min(chunk_start + chunk_size, stop))
+
+    def mask_buffer(self, name: str) -> np.ndarray:
+        """Returns a boolean scratch mask over the live worlds with undefined content. The same buffer is returned
+        for the same name until the worlds are filtered, so callers must not hold it across filters.
+        """
+        if name not in self._masks:
+            self._masks[name] = np.empty(self.capacity, dtype=bool)
+        return self._masks[name][:self._size]
+
+    def total_weight(self, worlds=None) -> int:
+        """Number of worlds (only the ones selected by the mask worlds if given), counted with their multiplicity."""
+        if self.weights is None:
+            return len(self) if worlds is None else int(np.count_nonzero(worlds))
+        return int(self.weights.sum() if worlds is None else self.weights[worlds].sum())
+
+    def player_dead(self, p: int) -> np.ndarray:
+        """Returns a mask of worlds where player p is dead."""
+        return (self.dead[:, p >> 3] & (1 << (p & 7))) != 0
+
+    def set_dead(self, p: int, worlds=slice(None)):
+        """Marks player p as dead in the given worlds (mask, index or slice), in all worlds by default."""
+        bit = np.uint8(1 << (p & 7))
+        if isinstance(worlds, np.ndarray) and worlds.dtype == bool:
+            # a single masked pass over the byte column, no gather/scatter of the selected worlds
+            column = self.dead[:, p >> 3]
+            np.bitwise_or(column, bit, out=column, where=worlds)
+        else:
+            self.dead[worlds, p >> 3] |= bit
+
+    def clear_dead(self, p: int, worlds: np.ndarray):
+        """Marks player p as alive again in the worlds with the given indices."""
+        self.dead[worlds, p >> 3] &= np.uint8(~(1 << (p & 7)) & 0xFF)
+
+    def dead_matrix(self, worlds=slice(None)) -> np.ndarray:
+        """Returns the unpacked N x P boolean matrix of dead flags (only of the selected worlds if given)."""
+        return np.unpackbits(self.dead[worlds], axis=1, count=self.num_players, bitorder="little").view(bool)
+
+    def filter(self, keep: np.ndarray) -> tuple:
+        """Only keeps the worlds where keep is True. The surviving worlds are moved to the front of the buffers in
+        place (the order of the worlds is not preserved), only the moved worlds are touched.
+        :return: (holes, fillers) of the move, see move
+        """
+        num_kept = int(np.count_nonzero(keep))
+        dtype = index_dtype(self.capacity)
+        holes = np.flatnonzero(np.logical_not(keep[:num_kept])).astype(dtype)  # dropped worlds in the part that stays
+        fillers = (np.flatnonzero(keep[num_kept:]) + num_kept).astype(dtype)  # surviving worlds behind that part
+        self.move(holes, fillers, num_kept)
+        return holes, fillers
+
+    def move(self, holes: np.ndarray, fillers: np.ndarray, size: int):
+        """Swaps the worlds at holes with the ones at fillers and then keeps the first size worlds. The dropped
+        worlds stay in the buffers behind the live ones, so a filter is reverted by the same move with the old size.
+        """
+        for column in self._columns.values():
+            dropped = column[holes]
+            column[holes] = column[fillers]
+            column[fillers] = dropped
+        self._size = size
+
+    def append(self, roles: np.ndarray, dead: np.ndarray) -> int:
+        """Adds worlds behind the live ones, as many as the buffers have room for. Added worlds count once, columns
+        added with add_column are 0 for them.
+        :return: Number of added worlds
+        """
+        num_added = min(len(roles), self.capacity - self._size)
+        added = slice(self._size, self._size + num_added)
+        for name, column in self._columns.items():
+            column[added] = {"roles": roles[:num_added], "dead": dead[:num_added], "weights": 1}.get(name, 0)
+        self._size += num_added
+        return num_added
+
+    def deduplicate(self):
+        """Merges identical worlds into a single world, whose weight is the summed weight of the merged ones.
+        Columns added with add_column are dropped.
+        """
+        rows = np.hstack([self.roles, self.dead])
+        unique, inverse = np.unique(rows, axis=0, return_inverse=True)
+        weights = np.bincount(inverse.ravel(), weights=self.weights, minlength=len(unique)).astype(WEIGHT_DTYPE)
+        self._columns = {"roles": np.ascontiguousarray(unique[:, :self.num_players]),
+                         "dead": np.ascontiguousarray(unique[:, self.num_players:]),
+                         "weights": weights}
+        self._size = len(unique)
+        self._masks = {}
 
+    def role_counts(self, num_roles: int, worlds=None) -> np.ndarray:
+        """Returns a P x (R + 1) matrix that counts in how many worlds each player has each role (weighted by the
+        multiplicity of the worlds). The last column counts the worlds where the player is dead.
+        If the mask worlds is given, only the selected worlds are counted.
+        """
+        counts = np.zeros((self.num_players, num_roles + 1), dtype=np.int64)
+        for chunk in self.chunks():
+            roles, dead, weights = self.roles[chunk], self.dead[chunk], self.weights
+            weights = None if weights is None else weights[chunk]
+            if worlds is not None:
+                selected = worlds[chunk]
+                roles, dead = roles[selected], dead[selected]
+                weights = None if weights is None else weights[selected]
+            counts += self._count_roles(num_roles, roles, dead, weights)
+        return counts
 
-def one_hot_encode(vec: np.ndarray) -> np.ndarray:
-    ret = np.zeros((vec.size, vec.max() + 1))
-    ret[np.arange(vec.size), vec] = 1
-    return ret
+    def _count_roles(self, num_roles: int, roles: np.ndarray, dead: np.ndarray, weights) -> np.ndarray:
+        """Role counts of the given rows of the buffers, see role_counts."""
+        P = self.num_players
+        dead = np.unpackbits(dead, axis=1, count=P, bitorder="little").view(bool)
+        counts = np.empty((P, num_roles + 1), dtype=np.int64)
+        flat = roles + np.arange(0, P * num_roles, num_roles)  # offsets every player into its own bins
+        if weights is None:
+            counts[:, :-1] = np.bincount(flat.ravel(), minlength=P * num_roles).reshape(P, num_roles)
+            counts[:, -1] = dead.sum(axis=0)
+        else:
+            repeated = np.repeat(weights.astype(np.float64), P)
+            counts[:, :-1] = np.bincount(flat.ravel(), weights=repeated, minlength=P * num_roles).reshape(P, num_roles)
+            counts[:, -1] = weights.astype(np.int64) @ dead
+        return counts
 
+    @staticmethod
+    def from_one_hot(world: np.ndarray) -> "WorldStore":
+        """Converts worlds in the old N x P x (R + 1) one-hot layout, e.g. from saves of older versions."""
+        roles = world[:, :, :-1].argmax(axis=2).astype(ROLE_DTYPE)
+        dead = np.packbits(world[:, :, -1] == 1, axis=1, bitorder="little")
+        return WorldStore(roles, dead)